@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Benchmarks the parse, merge, write and verify phases of merge_config, and the class_logger decorator
+
+Runs against synthetic configs of several sizes and against the real templates and defconfig
+Results are written as JSON, pass a previous result file with --compare to show the change
+"""
+
+__version__ = "0.1.0"
+
+from custom_logging import class_logger
+from merge_config import ConfigMerger, KernelConfig, ProvenanceIndex, DEFAULT_CONFIG_FILE
+
+from glob import glob
+from statistics import median
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+DEFAULT_REPEATS = 5
+DEFAULT_FRAGMENTS = 10
+DEFAULT_INSTANCES = 10000
+PHASES = ['load', 'merge', 'write', 'compare']
+
+
+def generate_config_lines(count, seed=0):
+    """
+    Generates count lines of a synthetic kernel config
+    Roughly matches the mix of the real templates, about a third of the lines are comments
+    """
+    rng = random.Random(seed)
+    lines = []
+    for index in range(count):
+        name = f"CONFIG_SYNTHETIC_{index}"
+        kind = rng.random()
+        if kind < 0.3:
+            lines.append(f"# Synthetic comment {index}\n")
+        elif kind < 0.45:
+            lines.append(f"# {name} is not set\n")
+        elif kind < 0.85:
+            lines.append(f"{name}={rng.choice('ymn')}\n")
+        elif kind < 0.95:
+            lines.append(f"{name}={rng.randint(-1, 65536)}\n")
+        else:
+            lines.append(f'{name}="value-{index}"\n')
+    return lines
+
+
+def generate_fragment_lines(count, fragment_count, seed=0):
+    """
+    Generates fragment_count fragments, each overriding a random tenth of a count line config
+    """
+    rng = random.Random(seed)
+    fragments = []
+    for fragment in range(fragment_count):
+        names = rng.sample(range(count), max(count // 10, 1))
+        fragments.append([f"# CONFIG_SYNTHETIC_{index} is not set\n" if rng.random() < 0.2
+                          else f"CONFIG_SYNTHETIC_{index}={rng.choice('ymn')}\n" for index in names])
+    return fragments
+
+
+def write_lines(file_name, lines):
+    with open(file_name, 'w') as config_file:
+        config_file.writelines(lines)
+    return file_name
+
+
+def time_calls(func, repeats, setup=None):
+    """
+    Calls func repeats times, returns the run times in seconds
+    If setup is passed, it is called untimed before each run and its result is passed to func
+    """
+    timings = []
+    for _ in range(repeats):
+        argument = setup() if setup else None
+        start = perf_counter()
+        func(argument) if setup else func()
+        timings.append(perf_counter() - start)
+    return timings
+
+
+def benchmark_case(base_file, merge_files, out_dir, repeats):
+    """
+    Times each phase for a base config and a stack of merge files
+    Returns a dict of phase name to timing summary
+    """
+    # The merge files are parsed up front and passed as merge configs, so the merge phase only times merging
+    merge_configs = [(merge_file, KernelConfig(merge_file)) for merge_file in merge_files]
+    merger = ConfigMerger(base_file, [], os.path.join(out_dir, 'benchmark.config'), no_make=True,
+                          merge_configs=merge_configs)
+
+    def merge(base_config):
+        # Merges through the same layered path as a real run, each merge config in its own layer
+        merger.base_config = base_config
+        merger.provenance = ProvenanceIndex()
+        merger.provenance.add_config(base_file, base_config)
+        merger.process_merge()
+
+    def write(_):
+        # Remove the output first so every run writes the whole file
+        if os.path.exists(merger.out_file_name):
+            os.remove(merger.out_file_name)
+        merger.write_config()
+
+    timings = {'load': time_calls(lambda: KernelConfig(base_file), repeats),
+               'merge': time_calls(merge, repeats, setup=lambda: KernelConfig(base_file))}
+    # The merged config is left on the merger by the last merge run
+    timings['write'] = time_calls(write, repeats, setup=lambda: None)
+    timings['write_unchanged'] = time_calls(merger.write_config, repeats)
+    compare_config = KernelConfig(base_file)
+    timings['compare'] = time_calls(lambda: merger._compare_config(compare_config), repeats)
+
+    return {phase: {'min': min(times), 'median': median(times), 'repeats': len(times)}
+            for phase, times in timings.items()}
+
+
+class LoggedRecord:
+    """ A small value class, similar to kernel_config.LinuxKernelConfigParameter without validation """
+    def __init__(self, name, value, defined=True):
+        self.name = name
+        self.value = value
+        self.defined = defined
+
+
+def benchmark_class_logger(repeats, count=DEFAULT_INSTANCES):
+    """
+    Times creating count instances of a small class, undecorated and with each class_logger mode
+    Logging is left at the WARNING level, so the timings only differ by the decorator overhead
+    """
+    variants = {'undecorated': LoggedRecord,
+                'class_logger': class_logger(LoggedRecord),
+                'per_instance': class_logger(per_instance=True)(LoggedRecord)}
+    timings = {name: time_calls(lambda variant=variant: [variant(f"CONFIG_{index}", 'y') for index in range(count)], repeats)
+               for name, variant in variants.items()}
+    return {phase: {'min': min(times), 'median': median(times), 'repeats': len(times)}
+            for phase, times in timings.items()}
+
+
+def run_benchmarks(sizes, repeats, fragment_count):
+    """
+    Runs the synthetic and real config benchmarks, returns the results dict
+    """
+    results = {}
+    with TemporaryDirectory(prefix='merge_config_benchmark.') as work_dir:
+        for size in sizes:
+            base_file = write_lines(os.path.join(work_dir, f"base-{size}.config"), generate_config_lines(size, seed=size))
+            merge_files = [write_lines(os.path.join(work_dir, f"fragment-{size}-{index}.config"), lines)
+                           for index, lines in enumerate(generate_fragment_lines(size, fragment_count, seed=size))]
+            print(f"Running synthetic benchmark: {size} lines, {fragment_count} fragments")
+            results[f"synthetic-{size}"] = benchmark_case(base_file, merge_files, work_dir, repeats)
+
+        templates = sorted(glob('templates/*.config'))
+        if os.path.isfile(DEFAULT_CONFIG_FILE) and templates:
+            print(f"Running templates benchmark: {len(templates)} fragments")
+            results['templates'] = benchmark_case(DEFAULT_CONFIG_FILE, templates, work_dir, repeats)
+
+    print(f"Running class_logger benchmark: {DEFAULT_INSTANCES} instances")
+    results['class_logger'] = benchmark_class_logger(repeats)
+    return results
+
+
+def compare_results(old_results, new_results):
+    """
+    Prints the median time change for each case and phase found in both results
+    """
+    print(f"{'case':<20} {'phase':<16} {'old ms':>10} {'new ms':>10} {'change':>8}")
+    for case, phases in new_results['results'].items():
+        for phase, timing in phases.items():
+            if not (old_timing := old_results['results'].get(case, {}).get(phase)):
+                continue
+            old_ms, new_ms = old_timing['median'] * 1000, timing['median'] * 1000
+            print(f"{case:<20} {phase:<16} {old_ms:>10.2f} {new_ms:>10.2f} {new_ms / old_ms:>7.2f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='merge-config-benchmark',
+                                     description='Benchmarks the merge_config phases')
+    parser.add_argument('-o',
+                        type=str,
+                        default='benchmark.json',
+                        help="The JSON result file, the default is benchmark.json")
+    parser.add_argument('-r',
+                        type=int,
+                        default=DEFAULT_REPEATS,
+                        help=f"The number of runs per phase, the default is {DEFAULT_REPEATS}")
+    parser.add_argument('-f',
+                        type=int,
+                        default=DEFAULT_FRAGMENTS,
+                        help=f"The number of synthetic fragments, the default is {DEFAULT_FRAGMENTS}")
+    parser.add_argument('--sizes',
+                        type=int,
+                        nargs='+',
+                        default=DEFAULT_SIZES,
+                        help=f"Synthetic config sizes in lines, the default is {DEFAULT_SIZES}")
+    parser.add_argument('--compare',
+                        type=str,
+                        help="A previous result file to compare against")
+    args = parser.parse_args()
+
+    # Silence merge logging and parse caching, only the work itself should be timed
+    logging.getLogger('merge_config').setLevel(logging.CRITICAL)
+    KernelConfig.cache = None
+
+    results = {'meta': {'version': __version__,
+                        'python': platform.python_version(),
+                        'platform': platform.platform(),
+                        'repeats': args.r,
+                        'fragments': args.f},
+               'results': run_benchmarks(args.sizes, args.r, args.f)}
+
+    with open(args.o, 'w') as result_file:
+        json.dump(results, result_file, indent=2)
+    print(f"Wrote benchmark results to: {args.o}")
+
+    if args.compare:
+        with open(args.compare, 'r') as old_result_file:
+            compare_results(json.load(old_result_file), results)
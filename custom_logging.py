@@ -1,54 +1,119 @@
 """
 Colors the loglevel by modifying the log record
 """
-__version__ = '1.3.5'
+__version__ = '1.4.0'
 __author__ = 'desultory'
 
+from inspect import Parameter, signature
 import logging
 from sys import modules
 
 
-def class_logger(cls):
+def _child_logger(parent_logger, name):
+    """
+    Returns a child logger of parent_logger
+    Adds a color stream handler if neither the child nor the parent has a handler
+    """
+    logger = parent_logger.getChild(name)
+    if not logger.handlers and not parent_logger.handlers:
+        color_stream_handler = logging.StreamHandler()
+        color_stream_handler.setFormatter(ColorLognameFormatter())
+        logger.addHandler(color_stream_handler)
+    return logger
+
+
+class _ClassLogger:
+    """
+    Class attribute which creates the logger of a class on first access, then caches it
+    Instances can override it by setting their own logger
+    """
+    def __init__(self, name):
+        self.name = name
+        self.logger = None
+
+    def __get__(self, instance, owner):
+        if self.logger is None:
+            self.logger = _child_logger(logging.getLogger(), self.name)
+        return self.logger
+
+
+def _accepts_kwargs(function):
+    """ Checks if a function accepts arbitrary kwargs, such as a logger """
+    try:
+        return any(parameter.kind is Parameter.VAR_KEYWORD for parameter in signature(function).parameters.values())
+    except (TypeError, ValueError):
+        return True
+
+
+def class_logger(cls=None, *, per_instance=False):
     """
     Decorator for classes to add a logging object and log basic tasks
+
+    By default, the logger is created once per class, as a child of the root logger,
+    if a logger is passed using the logger kwarg, the instance uses a child of it, cached per passed logger
+    The logger kwarg is only handled for classes whose __init__ accepts kwargs, other classes are not wrapped in an __init__,
+    so creating instances costs the same as without the decorator
+    Nothing is logged on init or assignment, so classes with many instances have no logging overhead
+
+    With @class_logger(per_instance=True), the init args, module version and class version are logged for each instance,
+    and every attribute assignment is logged at level 5
     """
+    if cls is None:
+        return lambda cls: class_logger(cls, per_instance=per_instance)
+
     class ClassWrapper(cls):
         __name__ = cls.__name__
         __module__ = cls.__module__
         __qualname__ = cls.__qualname__
-
+        # The class logger is created on first use, so handlers added after import are respected
+        logger = _ClassLogger(cls.__name__)
+        # Maps loggers passed using the logger kwarg to their child loggers
+        _child_loggers = {}
+
+        @classmethod
+        def child_logger(wrapper, parent_logger):
+            """ Returns the logger used by instances created with parent_logger passed using the logger kwarg """
+            if (logger := wrapper._child_loggers.get(parent_logger)) is None:
+                logger = wrapper._child_loggers[parent_logger] = _child_logger(parent_logger, cls.__name__)
+            return logger
+
+    if per_instance or _accepts_kwargs(cls.__init__):
         def __init__(self, *args, **kwargs):
-            parent_logger = kwargs.pop('logger') if isinstance(kwargs.get('logger'), logging.Logger) else logging.getLogger()
-            self.logger = parent_logger.getChild(cls.__name__)
+            if 'logger' in kwargs and isinstance(parent_logger := kwargs['logger'], logging.Logger):
+                del kwargs['logger']
+                self.logger = ClassWrapper.child_logger(parent_logger)
 
-            if not self.logger.handlers and not parent_logger.handlers:
-                color_stream_handler = logging.StreamHandler()
-                color_stream_handler.setFormatter(ColorLognameFormatter())
-                self.logger.addHandler(color_stream_handler)
+            if per_instance:
+                self.logger.info("Intializing class: %s" % cls.__name__)
 
-            self.logger.info("Intializing class: %s" % cls.__name__)
+                if args:
+                    self.logger.debug("Args: %s" % (args,))
+                if kwargs:
+                    self.logger.debug("Kwargs: %s" % kwargs)
+                if module_version := getattr(modules[cls.__module__], '__version__', None):
+                    self.logger.info("Module version: %s" % module_version)
+                if class_version := getattr(cls, '__version__', None):
+                    self.logger.info("Class version: %s" % class_version)
 
-            if args:
-                self.logger.debug("Args: %s" % args)
-            if kwargs:
-                self.logger.debug("Kwargs: %s" % kwargs)
-            if module_version := getattr(modules[cls.__module__], '__version__', None):
-                self.logger.info("Module version: %s" % module_version)
-            if class_version := getattr(cls, '__version__', None):
-                self.logger.info("Class version: %s" % class_version)
+            super(ClassWrapper, self).__init__(*args, **kwargs)
 
-            super().__init__(*args, **kwargs)
+        ClassWrapper.__init__ = __init__
 
+    if per_instance:
         def __setattr__(self, name, value):
-            super().__setattr__(name, value)
+            super(ClassWrapper, self).__setattr__(name, value)
             if not isinstance(self.logger, logging.Logger):
                 raise ValueError("The logger is not defined")
+            if not self.logger.isEnabledFor(5):
+                return
 
             if isinstance(value, list) or isinstance(value, dict) or isinstance(value, str) and "\n" in value:
                 self.logger.log(5, "Set '%s' to:\n%s" % (name, value))
             else:
                 self.logger.log(5, "Set '%s' to: %s" % (name, value))
 
+        ClassWrapper.__setattr__ = __setattr__
+
     return ClassWrapper
 
 
@@ -3,16 +3,23 @@
 Used to create kernel configuration files for specific hardware configurations
 """
 
-__version__ = "0.0.3"
+__version__ = "0.1.0"
 
 from CustomLogging import class_logger
+from pickle_cache import is_private_dir
 
-from jinja2 import Environment, PackageLoader, select_autoescape
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha256
+from jinja2 import Environment, FileSystemBytecodeCache, PackageLoader, meta, select_autoescape
+import argparse
+import json
 import logging
+import os
 import re
 import yaml
 
-logging.root.setLevel(10)
+DEFAULT_CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'generate_config')
+DEFAULT_CACHE_ENTRIES = 256
 
 
 @class_logger
@@ -84,15 +91,224 @@ class LinuxKernelConfigParameter:
         return f"{self.name}={self.value}" if self.defined else f"# {self.name} is not set"
 
 
+@class_logger
+class TemplateRenderer:
+    """
+    Renders the config templates, caching the results
+
+    Compiled templates are kept in a jinja bytecode cache under cache_dir
+    Renders are memoized, in memory and under cache_dir, keyed by the template variables and the sources of the template
+    and every template it includes, imports or extends, so the same templates rendered with the same features and variables
+    are only rendered once
+    Templates which reference others by a name only known when rendering are not cached
+    The templates each template references are cached by a hash of its source, so cached renders are found without parsing
+    The oldest renders are removed from cache_dir once there are more than max_entries
+
+    When jobs is greater than 1, templates which are not cached are rendered concurrently in a process pool
+    If cache_dir is None, or is not owned by the current user with mode 0700, nothing is read from or written to disk
+    """
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, jobs=1, max_entries=DEFAULT_CACHE_ENTRIES, *args, **kwargs):
+        self.cache_dir = cache_dir
+        if self.cache_dir and not self._is_private(self.cache_dir):
+            self.logger.warning("Not using the template cache directory, it must be owned by the current user "
+                                "with mode 0700: %s" % self.cache_dir)
+            self.cache_dir = None
+        self.jobs = jobs
+        self.max_entries = max_entries
+        bytecode_cache = FileSystemBytecodeCache(self._cache_subdir('bytecode')) if self.cache_dir else None
+        self.environment = Environment(loader=PackageLoader("generate_config"),
+                                       autoescape=select_autoescape(),
+                                       bytecode_cache=bytecode_cache)
+        self._renders = {}
+        self._references = {}
+
+    @staticmethod
+    def _is_private(cache_dir):
+        """ Creates the cache directory if it does not exist, returns True if it and its subdirectories are private """
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        subdirs = [os.path.join(cache_dir, name) for name in ('bytecode', 'references', 'renders')]
+        return all(is_private_dir(directory) for directory in [cache_dir, *subdirs] if os.path.exists(directory))
+
+    def _cache_subdir(self, name):
+        directory = os.path.join(self.cache_dir, name)
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        return directory
+
+    def referenced_templates(self, name, source):
+        """
+        Returns the names of the templates a template source includes, imports or extends,
+        None if it references a template by a name only known when rendering
+        """
+        digest = sha256(source.encode()).hexdigest()
+        if digest not in self._references:
+            if (references := self._cached_references(digest, name)) is False:
+                references = list(meta.find_referenced_templates(self.environment.parse(source)))
+                references = None if None in references else references
+                self._store_references(digest, name, references)
+            self._references[digest] = references
+        return self._references[digest]
+
+    def _cached_references(self, digest, name):
+        """ Returns the cached references of a template source, or False """
+        if not self.cache_dir:
+            return False
+        try:
+            with open(os.path.join(self._cache_subdir('references'), digest), 'r') as references_file:
+                return json.load(references_file)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            self.logger.warning("Unable to load cached references of template '%s': %s" % (name, e))
+            return False
+
+    def _store_references(self, digest, name, references):
+        if not self.cache_dir:
+            return
+        references_path = os.path.join(self._cache_subdir('references'), digest)
+        temp_path = f"{references_path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, 'w') as references_file:
+                json.dump(references, references_file)
+            os.replace(temp_path, references_path)
+        except OSError as e:
+            self.logger.warning("Unable to cache references of template '%s': %s" % (name, e))
+
+    def template_sources(self, template_name):
+        """
+        Returns the sources of a template and every template it includes, imports or extends, keyed by template name
+        Returns None if a template references another by a name only known when rendering
+        """
+        sources = {}
+        pending = [template_name]
+        while pending:
+            if (name := pending.pop()) in sources:
+                continue
+            source, _, _ = self.environment.loader.get_source(self.environment, name)
+            sources[name] = source
+            if (references := self.referenced_templates(name, source)) is None:
+                self.logger.debug("Not caching template '%s', '%s' references a template by variable" % (template_name, name))
+                return None
+            pending.extend(references)
+        return sources
+
+    def render_key(self, template_name, variables):
+        """ Returns the cache key for a template rendered with a dict of variables, or None if it cannot be cached """
+        if (sources := self.template_sources(template_name)) is None:
+            return None
+        key = sha256(json.dumps(variables, sort_keys=True, default=str).encode())
+        for name, source in sorted(sources.items()):
+            key.update(f"\0{name}\0{source}".encode())
+        return key.hexdigest()
+
+    def _cached_render(self, key):
+        """ Returns a cached render, or None """
+        if (rendered := self._renders.get(key)) is not None or not self.cache_dir:
+            return rendered
+        try:
+            with open(os.path.join(self._cache_subdir('renders'), key), 'r') as render_file:
+                rendered = self._renders[key] = render_file.read()
+        except FileNotFoundError:
+            return None
+        self.logger.debug("Loaded cached render: %s" % key)
+        return rendered
+
+    def _store_render(self, key, rendered):
+        self._renders[key] = rendered
+        if not self.cache_dir:
+            return
+        try:
+            self._write_render(key, rendered)
+        except OSError as e:
+            self.logger.warning("Unable to cache render '%s': %s" % (key, e))
+
+    def _write_render(self, key, rendered):
+        renders_dir = self._cache_subdir('renders')
+        render_path = os.path.join(renders_dir, key)
+        temp_path = f"{render_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as render_file:
+            render_file.write(rendered)
+        os.replace(temp_path, render_path)
+
+        entries = [entry.path for entry in os.scandir(renders_dir) if not entry.name.endswith('.tmp')]
+        if len(entries) > self.max_entries:
+            entries.sort(key=os.path.getmtime)
+            for old_entry in entries[:len(entries) - self.max_entries]:
+                os.remove(old_entry)
+
+    def render_uncached(self, template_name, variables):
+        """ Renders a template, without checking the render cache """
+        self.logger.info("Rendering template: %s" % template_name)
+        return self.environment.get_template(template_name).render(**variables)
+
+    def render(self, template_name, variables):
+        """ Renders a template with a dict of variables, using the cache """
+        return self.render_all([template_name], variables)[0]
+
+    def render_all(self, template_names, variables):
+        """
+        Renders each template with a dict of variables, returns the renders in the order of the template names
+        """
+        keys = [self.render_key(template_name, variables) for template_name in template_names]
+        renders = [self._cached_render(key) if key else None for key in keys]
+        # Templates listed more than once are only rendered once, templates without a key are listed by their index
+        missing = {key or index: template_name
+                   for index, (key, template_name, rendered) in enumerate(zip(keys, template_names, renders)) if rendered is None}
+
+        if self.jobs > 1 and len(missing) > 1:
+            self.logger.info("Rendering %s templates using %s jobs" % (len(missing), self.jobs))
+            with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+                rendered = dict(zip(missing, executor.map(_render_template, [self.cache_dir] * len(missing),
+                                                          missing.values(), [variables] * len(missing))))
+        else:
+            rendered = {key: self.render_uncached(template_name, variables) for key, template_name in missing.items()}
+
+        for key, template_render in rendered.items():
+            if isinstance(key, str):
+                self._store_render(key, template_render)
+        return [render if render is not None else rendered[key or index]
+                for index, (key, render) in enumerate(zip(keys, renders))]
+
+
+# The renderer of each process pool worker, created on first use so the bytecode cache is shared
+_worker_renderer = None
+
+
+def _render_template(cache_dir, template_name, variables):
+    """ Renders a template in a process pool worker """
+    global _worker_renderer
+    if _worker_renderer is None:
+        _worker_renderer = TemplateRenderer(cache_dir=cache_dir)
+    return _worker_renderer.render_uncached(template_name, variables)
+
+
 if __name__ == '__main__':
-    with open('config.yaml', 'r') as f:
-        base_config = yaml.safe_load(f)
+    logging.root.setLevel(10)
 
-    templates = base_config.pop('templates')
+    parser = argparse.ArgumentParser(prog='generate-config',
+                                     description='Renders the kernel config templates listed in a config file')
+    parser.add_argument('config',
+                        type=str,
+                        nargs='?',
+                        default='config.yaml',
+                        help="The config file, the default is config.yaml")
+    parser.add_argument('-j',
+                        type=int,
+                        default=1,
+                        help="Number of processes used to render templates which are not cached")
+    parser.add_argument('--no-cache',
+                        action='store_true',
+                        help="Disable the template bytecode and render caches")
+    parser.add_argument('--cache-dir',
+                        type=str,
+                        default=DEFAULT_CACHE_DIR,
+                        help=f"The template cache directory, the default is {DEFAULT_CACHE_DIR}")
+    args = parser.parse_args()
 
-    jinja_env = Environment(loader=PackageLoader("generate_config"), autoescape=select_autoescape())
+    with open(args.config, 'r') as f:
+        base_config = yaml.safe_load(f)
 
-    for template in templates:
-        jinja_template = jinja_env.get_template(template)
-        print(jinja_template.render(**base_config))
+    templates = base_config.pop('templates')
 
+    renderer = TemplateRenderer(cache_dir=None if args.no_cache else args.cache_dir, jobs=args.j)
+    for rendered in renderer.render_all(templates, base_config):
+        print(rendered)
@@ -0,0 +1,1246 @@
+"""
+Parses linux kernel Kconfig files into a symbol table
+
+Follows source statements from the top level Kconfig, records the type, prompt,
+dependencies, selects and defaults of each symbol, and caches the table per kernel tree
+
+"""
+
+__author__ = "desultory"
+__version__ = "0.1.0"
+
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+from hashlib import sha256
+import logging
+import os
+import re
+
+from pickle_cache import PickleCache
+
+DEFAULT_CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'merge_config')
+
+logger = logging.getLogger(__name__)
+
+
+class KconfigError(Exception):
+    pass
+
+
+# Expressions are stored as tuples:
+#   ('sym', name) - a symbol or constant such as y, m, n or 64
+#   ('str', text) - a quoted string
+#   ('macro', text) - a $(...) macro, which is not expanded
+#   ('not', expr), ('and', left, right), ('or', left, right)
+#   ('cmp', operator, left, right)
+_EXPR_TOKEN_REGEX = re.compile(r'\s*(?:(?P<op>&&|\|\||!=|<=|>=|[!()=<>])'
+                               r'|"(?P<dstr>(?:[^"\\]|\\.)*)"'
+                               r"|'(?P<sstr>(?:[^'\\]|\\.)*)'"
+                               r'|(?P<word>[A-Za-z0-9_.+\-/]+))')
+_COMPARE_OPS = {'=', '!=', '<', '<=', '>', '>='}
+
+
+def tokenize_expression(text):
+    """
+    Splits a Kconfig expression into a list of tokens
+    Operators and words are strings, quoted strings are ('str', text) and macros are ('macro', text)
+    """
+    tokens = []
+    position = 0
+    while position < len(text):
+        if text[position].isspace():
+            position += 1
+            continue
+        # Macros may contain spaces, commas and nested parens
+        if text.startswith('$(', position):
+            depth, end = 0, position + 1
+            while end < len(text):
+                depth += {'(': 1, ')': -1}.get(text[end], 0)
+                if depth == 0:
+                    break
+                end += 1
+            tokens.append(('macro', text[position:end + 1]))
+            position = end + 1
+            continue
+        if not (match := _EXPR_TOKEN_REGEX.match(text, position)) or match.end() == position:
+            raise KconfigError(f"Unable to tokenize expression at: {text[position:]}")
+        if match.group('op'):
+            tokens.append(match.group('op'))
+        elif match.group('word') is not None:
+            tokens.append(match.group('word'))
+        else:
+            tokens.append(('str', match.group('dstr') if match.group('dstr') is not None else match.group('sstr')))
+        position = match.end()
+    return tokens
+
+
+class _ExpressionParser:
+    """
+    Recursive descent parser for a tokenized Kconfig expression
+    Stops at a top level 'if' word, so 'default X if Y' can be split
+    """
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def take(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def parse(self):
+        return self.parse_or()
+
+    def parse_or(self):
+        expression = self.parse_and()
+        while self.peek() == '||':
+            self.take()
+            expression = ('or', expression, self.parse_and())
+        return expression
+
+    def parse_and(self):
+        expression = self.parse_not()
+        while self.peek() == '&&':
+            self.take()
+            expression = ('and', expression, self.parse_not())
+        return expression
+
+    def parse_not(self):
+        if self.peek() == '!':
+            self.take()
+            return ('not', self.parse_not())
+        return self.parse_compare()
+
+    def parse_compare(self):
+        expression = self.parse_primary()
+        if self.peek() in _COMPARE_OPS:
+            operator = self.take()
+            expression = ('cmp', operator, expression, self.parse_primary())
+        return expression
+
+    def parse_primary(self):
+        token = self.take()
+        if token == '(':
+            expression = self.parse_or()
+            if self.take() != ')':
+                raise KconfigError(f"Unbalanced parens in expression: {self.tokens}")
+            return expression
+        if isinstance(token, tuple):
+            return token
+        if token is None or token in _COMPARE_OPS or token in ('&&', '||', ')'):
+            raise KconfigError(f"Unexpected token '{token}' in expression: {self.tokens}")
+        return ('sym', token)
+
+
+def parse_expression(text):
+    """
+    Parses a Kconfig expression string, returns the expression tuple
+    """
+    parser = _ExpressionParser(tokenize_expression(text))
+    expression = parser.parse()
+    if parser.peek() is not None:
+        raise KconfigError(f"Unexpected trailing tokens in expression: {text}")
+    return expression
+
+
+def parse_value_and_condition(text):
+    """
+    Parses 'VALUE [if CONDITION]', returns a tuple of (value expression, condition expression or None)
+    """
+    parser = _ExpressionParser(tokenize_expression(text))
+    value = parser.parse()
+    condition = None
+    if parser.peek() == 'if':
+        parser.take()
+        condition = parser.parse()
+    if parser.peek() is not None:
+        raise KconfigError(f"Unexpected trailing tokens: {text}")
+    return value, condition
+
+
+def and_expressions(expressions):
+    """
+    Combines a list of expressions with &&, returns None for an empty list
+    """
+    combined = None
+    for expression in expressions:
+        if expression is not None:
+            combined = expression if combined is None else ('and', combined, expression)
+    return combined
+
+
+def expression_symbols(expression):
+    """
+    Yields the names of the symbols referenced by an expression
+    """
+    if expression is None:
+        return
+    match expression[0]:
+        case 'sym':
+            yield expression[1]
+        case 'not':
+            yield from expression_symbols(expression[1])
+        case 'and' | 'or':
+            yield from expression_symbols(expression[1])
+            yield from expression_symbols(expression[2])
+        case 'cmp':
+            yield from expression_symbols(expression[2])
+            yield from expression_symbols(expression[3])
+
+
+def expression_has_macro(expression):
+    """
+    Checks if an expression contains a $(...) macro
+    """
+    if expression is None:
+        return False
+    match expression[0]:
+        case 'macro':
+            return True
+        case 'not':
+            return expression_has_macro(expression[1])
+        case 'and' | 'or':
+            return expression_has_macro(expression[1]) or expression_has_macro(expression[2])
+        case 'cmp':
+            return expression_has_macro(expression[2]) or expression_has_macro(expression[3])
+    return False
+
+
+def format_expression(expression):
+    """
+    Formats an expression tuple back into Kconfig syntax
+    """
+    if expression is None:
+        return 'y'
+    match expression[0]:
+        case 'sym' | 'macro':
+            return expression[1]
+        case 'str':
+            return f'"{expression[1]}"'
+        case 'not':
+            inner = format_expression(expression[1])
+            return f"!{inner}" if expression[1][0] in ('sym', 'str', 'macro') else f"!({inner})"
+        case 'and' | 'or':
+            operator = '&&' if expression[0] == 'and' else '||'
+            parts = []
+            for side in expression[1:]:
+                side_str = format_expression(side)
+                # Parenthesize an || inside an &&
+                parts.append(f"({side_str})" if expression[0] == 'and' and side[0] == 'or' else side_str)
+            return f" {operator} ".join(parts)
+        case 'cmp':
+            return f"{format_expression(expression[2])}{expression[1]}{format_expression(expression[3])}"
+
+
+class KconfigSymbol:
+    """
+    A single Kconfig symbol, names do not include the CONFIG_ prefix
+
+    depends is the full dependency expression, including enclosing menus, ifs and choices
+    selects and implies are lists of (symbol name, condition)
+    defaults are lists of (value expression, condition)
+    """
+    __slots__ = ('name', 'type', 'prompt', 'prompt_condition', 'depends', 'selects', 'implies',
+                 'defaults', 'ranges', 'choice', 'locations')
+
+    def __init__(self, name):
+        self.name = name
+        self.type = None
+        self.prompt = None
+        self.prompt_condition = None
+        self.depends = None
+        self.selects = []
+        self.implies = []
+        self.defaults = []
+        self.ranges = []
+        self.choice = None
+        self.locations = []
+
+    def merge(self, other):
+        """
+        Merges another definition of the same symbol into this one
+        The symbol depends on either definition being satisfied
+        """
+        self.type = self.type or other.type
+        if other.prompt and not self.prompt:
+            self.prompt, self.prompt_condition = other.prompt, other.prompt_condition
+        if self.depends is None or other.depends is None:
+            self.depends = None
+        elif self.depends != other.depends:
+            self.depends = ('or', self.depends, other.depends)
+        self.selects += other.selects
+        self.implies += other.implies
+        self.defaults += other.defaults
+        self.ranges += other.ranges
+        self.choice = self.choice or other.choice
+        self.locations += other.locations
+
+    def __repr__(self):
+        return f"<KconfigSymbol {self.name} {self.type} at {self.locations[0] if self.locations else '?'}>"
+
+
+class KconfigChoice:
+    """
+    A choice block, only one of its bool symbols can be y
+    """
+    __slots__ = ('name', 'type', 'prompt', 'depends', 'defaults', 'symbols', 'optional', 'location')
+
+    def __init__(self, name, location):
+        self.name = name
+        self.type = 'bool'
+        self.prompt = None
+        self.depends = None
+        self.defaults = []
+        self.symbols = []
+        self.optional = False
+        self.location = location
+
+
+class _FileParser:
+    """
+    Parses a single Kconfig file without following source statements
+
+    Dependencies from enclosing if/menu/choice blocks are applied to the symbols in the file,
+    source statements are returned with the dependencies in effect where they appear,
+    so files can be parsed independently and their contexts joined afterwards
+    """
+    _TYPES = {'bool', 'tristate', 'string', 'int', 'hex'}
+    _DEF_TYPES = {'def_bool': 'bool', 'def_tristate': 'tristate'}
+    _SOURCE_KEYWORDS = {'source', 'rsource', 'osource', 'orsource'}
+    _PROMPT_REGEX = re.compile(r'\s*("(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\')\s*(?:if\s+(.*))?$')
+
+    def __init__(self, file_name, tree):
+        self.file_name = file_name
+        self.tree = tree
+        self.symbols = []
+        self.choices = []
+        self.sources = []
+        # Stack of (block keyword, dependency expression, visibility expression)
+        self._blocks = []
+        self._entry = None
+        # The kind of statement the following attribute lines belong to, ex. 'config', 'menu' or 'comment'
+        self._entry_kind = None
+        self._entry_depends = []
+        self._choice = None
+
+    def _logical_lines(self):
+        """
+        Yields (line number, line) with continuations joined and help text removed
+        """
+        with open(os.path.join(self.tree, self.file_name), 'r', errors='replace') as kconfig_file:
+            lines = kconfig_file.read().split('\n')
+
+        line_index = 0
+        while line_index < len(lines):
+            line_number = line_index + 1
+            line = lines[line_index]
+            while line.endswith('\\') and line_index + 1 < len(lines):
+                line_index += 1
+                line = line[:-1] + lines[line_index]
+            line_index += 1
+
+            stripped = line.strip()
+            if stripped in ('help', '---help---'):
+                # Help text continues while lines are blank or indented past the first help line
+                help_indent = None
+                while line_index < len(lines):
+                    help_line = lines[line_index]
+                    if help_line.strip():
+                        indent = len(help_line.expandtabs()) - len(help_line.expandtabs().lstrip())
+                        if help_indent is None:
+                            help_indent = indent
+                        if indent < help_indent or indent == 0:
+                            break
+                    line_index += 1
+                continue
+            yield line_number, stripped
+
+    def _block_depends(self):
+        return [depends for _, depends, _ in self._blocks]
+
+    def _block_visibility(self):
+        return [visible for _, _, visible in self._blocks]
+
+    def _finish_entry(self):
+        """
+        Applies the collected depends on lines to the current entry
+        """
+        self._entry_kind = None
+        if self._entry is None:
+            return
+        if isinstance(self._entry, KconfigSymbol):
+            self._entry.depends = and_expressions(self._block_depends() + self._entry_depends)
+            self._entry.prompt_condition = and_expressions(self._block_visibility() + [self._entry.prompt_condition])
+        else:
+            self._entry.depends = and_expressions(self._block_depends() + self._entry_depends)
+            # Choice dependencies apply to the symbols inside the choice
+            self._blocks.append(('choice', and_expressions(self._entry_depends), None))
+        self._entry = None
+        self._entry_depends = []
+
+    def _parse_prompt(self, text):
+        """
+        Parses '"prompt" [if condition]', returns (prompt, condition)
+        """
+        if not (match := self._PROMPT_REGEX.match(text)):
+            raise KconfigError(f"Invalid prompt: {text}")
+        condition = parse_expression(match.group(2)) if match.group(2) else None
+        return match.group(1)[1:-1], condition
+
+    def parse(self):
+        for line_number, line in self._logical_lines():
+            if not line or line.startswith('#'):
+                continue
+            keyword, _, rest = line.partition(' ')
+            keyword, rest = keyword.strip(), rest.strip()
+            try:
+                self._parse_statement(keyword, rest, line_number)
+            except KconfigError as e:
+                logger.warning("%s:%s: %s", self.file_name, line_number, e)
+        self._finish_entry()
+        return self
+
+    def _parse_statement(self, keyword, rest, line_number):
+        entry = self._entry
+        if keyword in ('config', 'menuconfig'):
+            self._finish_entry()
+            self._entry_kind = 'config'
+            self._entry = KconfigSymbol(rest)
+            self._entry.locations.append((self.file_name, line_number))
+            if self._choice is not None:
+                self._entry.choice = self._choice.name
+                self._choice.symbols.append(rest)
+            self.symbols.append(self._entry)
+        elif keyword == 'choice':
+            self._finish_entry()
+            self._choice = KconfigChoice(rest or f"<choice {self.file_name}:{line_number}>", (self.file_name, line_number))
+            self._entry_kind = 'choice'
+            self._entry = self._choice
+            self.choices.append(self._choice)
+        elif keyword == 'endchoice':
+            self._finish_entry()
+            self._pop_block('choice')
+            self._choice = None
+        elif keyword in ('menu', 'comment'):
+            self._finish_entry()
+            # Depends on a menu apply to its contents, depends on a comment only hide the comment
+            self._entry_kind = keyword
+            if keyword == 'menu':
+                self._blocks.append(('menu', None, None))
+        elif keyword == 'endmenu':
+            self._finish_entry()
+            self._pop_block('menu')
+        elif keyword == 'if':
+            self._finish_entry()
+            self._blocks.append(('if', parse_expression(rest), None))
+        elif keyword == 'endif':
+            self._finish_entry()
+            self._pop_block('if')
+        elif keyword in self._SOURCE_KEYWORDS:
+            self._finish_entry()
+            path, _ = self._parse_prompt(rest)
+            if keyword in ('rsource', 'orsource'):
+                path = os.path.join(os.path.dirname(self.file_name), path)
+            self.sources.append((path, self._block_depends(), self._block_visibility(),
+                                 keyword in ('osource', 'orsource')))
+        elif keyword in ('mainmenu',):
+            self._finish_entry()
+        elif keyword == 'depends':
+            depends = parse_expression(rest.removeprefix('on').strip())
+            if self._entry_kind == 'menu':
+                block, block_depends, visible = self._blocks.pop()
+                self._blocks.append((block, and_expressions([block_depends, depends]), visible))
+            elif entry is not None:
+                self._entry_depends.append(depends)
+        elif keyword == 'visible':
+            if self._entry_kind == 'menu':
+                block, block_depends, visible = self._blocks.pop()
+                self._blocks.append((block, block_depends, and_expressions([visible, parse_expression(rest.removeprefix('if').strip())])))
+        elif entry is None:
+            return
+        elif keyword in self._TYPES or keyword in self._DEF_TYPES:
+            entry.type = self._DEF_TYPES.get(keyword, keyword)
+            if keyword in self._DEF_TYPES:
+                entry.defaults.append(parse_value_and_condition(rest))
+            elif rest:
+                prompt, condition = self._parse_prompt(rest)
+                entry.prompt = prompt
+                if isinstance(entry, KconfigSymbol):
+                    entry.prompt_condition = condition
+        elif keyword == 'prompt':
+            prompt, condition = self._parse_prompt(rest)
+            entry.prompt = prompt
+            if isinstance(entry, KconfigSymbol):
+                entry.prompt_condition = condition
+        elif keyword == 'default':
+            entry.defaults.append(parse_value_and_condition(rest))
+        elif keyword in ('select', 'imply') and isinstance(entry, KconfigSymbol):
+            target, condition = parse_value_and_condition(rest)
+            (entry.selects if keyword == 'select' else entry.implies).append((target[1], condition))
+        elif keyword == 'range' and isinstance(entry, KconfigSymbol):
+            parser = _ExpressionParser(tokenize_expression(rest))
+            low, high = parser.parse_primary(), parser.parse_primary()
+            condition = None
+            if parser.peek() == 'if':
+                parser.take()
+                condition = parser.parse()
+            entry.ranges.append((low, high, condition))
+        elif keyword == 'optional' and isinstance(entry, KconfigChoice):
+            entry.optional = True
+
+    def _pop_block(self, keyword):
+        if not self._blocks or self._blocks[-1][0] != keyword:
+            raise KconfigError(f"Unexpected end{keyword}")
+        self._blocks.pop()
+
+
+def _parse_file(file_name, tree):
+    """
+    Parses a single Kconfig file, used as the process pool worker
+    Returns the (symbols, choices, sources) of the file
+    """
+    parser = _FileParser(file_name, tree).parse()
+    return parser.symbols, parser.choices, parser.sources
+
+
+class SymbolTable:
+    """
+    The symbols defined by the Kconfig files of a kernel tree
+
+    Files are parsed in waves, following source statements, using a process pool when jobs > 1
+    Symbol names do not include the CONFIG_ prefix
+    """
+    _CACHE_VERSION = 2
+    _SOURCE_REGEX = re.compile(r'^\s*(o?r?source)\s+["\']?([^"\'\s]+)', re.MULTILINE)
+
+    def __init__(self, tree='.', arch=None, jobs=None):
+        self.tree = tree
+        self.srcarch = self._srcarch(arch or os.environ.get('ARCH') or os.environ.get('SRCARCH') or 'x86')
+        self.jobs = jobs if jobs is not None else os.cpu_count()
+        self.symbols = {}
+        self.choices = {}
+        # Maps each parsed file to its (size, mtime), to check if a cached table is stale
+        self.files = {}
+        # Maps each source path to the files it matched, so files added under a sourced glob make the table stale
+        self.sources = {}
+
+    @staticmethod
+    def _srcarch(arch):
+        return {'x86_64': 'x86', 'i386': 'x86', 'sparc64': 'sparc', 'sparc32': 'sparc',
+                'parisc64': 'parisc', 'sh64': 'sh'}.get(arch, arch)
+
+    def _expand_path(self, path):
+        """
+        Expands $(VAR) and $VAR in a source path, using SRCARCH for the arch variables
+        """
+        def lookup(match):
+            name = match.group(1) or match.group(2)
+            if name in ('SRCARCH', 'ARCH', 'HEADER_ARCH'):
+                return self.srcarch
+            return os.environ.get(name, '')
+        return re.sub(r'\$\((\w+)\)|\$(\w+)', lookup, path)
+
+    def parse(self, top_file='Kconfig'):
+        """
+        Parses the top level Kconfig file and every file it sources
+        """
+        # Each pending entry is (file name, inherited depends, inherited visibility)
+        pending = [(top_file, [], [])]
+        executor = ProcessPoolExecutor(max_workers=self.jobs) if self.jobs > 1 else None
+        try:
+            while pending:
+                logger.debug("Parsing %s Kconfig files", len(pending))
+                if executor:
+                    results = executor.map(_parse_file, [file_name for file_name, _, _ in pending],
+                                           [self.tree] * len(pending))
+                else:
+                    results = (_parse_file(file_name, self.tree) for file_name, _, _ in pending)
+
+                next_pending = []
+                for (file_name, depends, visibility), (symbols, choices, sources) in zip(pending, results):
+                    file_stat = os.stat(os.path.join(self.tree, file_name))
+                    self.files[file_name] = (file_stat.st_size, file_stat.st_mtime_ns)
+                    self._add_file(symbols, choices, depends, visibility)
+                    for source_path, source_depends, source_visibility, optional in sources:
+                        expanded = self._expand_path(source_path)
+                        matches = self.sources[source_path] = self._source_matches(expanded)
+                        if not matches and not optional:
+                            logger.warning("Unable to find sourced Kconfig file: %s (from %s)", expanded, file_name)
+                        for match in matches:
+                            if match not in self.files:
+                                next_pending.append((match, depends + source_depends, visibility + source_visibility))
+                # A file sourced twice in one wave is only parsed once
+                seen = set()
+                pending = [entry for entry in next_pending if not (entry[0] in seen or seen.add(entry[0]))]
+        finally:
+            if executor:
+                executor.shutdown()
+        logger.info("Parsed %s Kconfig symbols from %s files", len(self.symbols), len(self.files))
+        return self
+
+    def source_files(self, top_file='Kconfig'):
+        """
+        Returns the top level Kconfig file and every file it sources, relative to the tree, without parsing them
+        Source statements are found with a regex, which is enough to tell if the Kconfig files changed
+        """
+        files = []
+        pending = [top_file]
+        seen = {top_file}
+        while pending:
+            file_name = pending.pop(0)
+            try:
+                with open(os.path.join(self.tree, file_name), 'r', errors='replace') as kconfig_file:
+                    contents = kconfig_file.read()
+            except FileNotFoundError:
+                continue
+            files.append(file_name)
+            for keyword, path in self._SOURCE_REGEX.findall(contents):
+                if keyword.endswith('rsource'):
+                    path = os.path.join(os.path.dirname(file_name), path)
+                for match in self._source_matches(self._expand_path(path)):
+                    if match not in seen:
+                        seen.add(match)
+                        pending.append(match)
+        return files
+
+    def _add_file(self, symbols, choices, depends, visibility):
+        """
+        Adds the symbols and choices of a parsed file, applying the dependencies inherited from where it was sourced
+        """
+        for choice in choices:
+            choice.depends = and_expressions(depends + [choice.depends])
+            self.choices[choice.name] = choice
+        for symbol in symbols:
+            symbol.depends = and_expressions(depends + [symbol.depends])
+            symbol.prompt_condition = and_expressions(visibility + [symbol.prompt_condition])
+            if existing := self.symbols.get(symbol.name):
+                existing.merge(symbol)
+            else:
+                self.symbols[symbol.name] = symbol
+
+    def _source_matches(self, expanded_path):
+        """
+        Returns the files matched by an expanded source path, relative to the tree
+        """
+        return tuple(sorted(os.path.relpath(path, self.tree) for path in glob(os.path.join(self.tree, expanded_path))))
+
+    def is_stale(self):
+        """
+        Checks if any parsed file changed, or any source path matches different files, since the table was parsed
+        """
+        for source_path, matches in self.sources.items():
+            if self._source_matches(self._expand_path(source_path)) != matches:
+                return True
+        for file_name, file_stat in self.files.items():
+            try:
+                current_stat = os.stat(os.path.join(self.tree, file_name))
+            except FileNotFoundError:
+                return True
+            if (current_stat.st_size, current_stat.st_mtime_ns) != file_stat:
+                return True
+        return False
+
+    @classmethod
+    def _cache_key(cls, tree, srcarch):
+        key = f"{cls._CACHE_VERSION}\0{os.path.abspath(tree)}\0{srcarch}"
+        return f"kconfig-{sha256(key.encode()).hexdigest()}"
+
+    @classmethod
+    def load(cls, tree='.', arch=None, jobs=None, cache_dir=DEFAULT_CACHE_DIR):
+        """
+        Returns the symbol table for a kernel tree, using the cached table if no Kconfig file changed
+        If cache_dir is None, the tree is always parsed
+        """
+        symbol_table = cls(tree, arch, jobs)
+        if cache_dir is None:
+            return symbol_table.parse()
+
+        cache = PickleCache(cache_dir, logger=logger)
+        cache_path = cache.path(cls._cache_key(tree, symbol_table.srcarch))
+        if (cached_table := cache.get(cache_path, f"Kconfig symbol table of {tree}")) is not None:
+            if not cached_table.is_stale():
+                logger.info("Loaded the Kconfig symbol table from the cache: %s", cache_path)
+                cached_table.jobs = symbol_table.jobs
+                return cached_table
+            logger.info("Kconfig files changed, reparsing the tree: %s", tree)
+
+        symbol_table.parse()
+        cache.put(cache_path, f"Kconfig symbol table of {tree}", symbol_table)
+        return symbol_table
+
+    def get(self, name):
+        """
+        Returns the symbol for a name, with or without the CONFIG_ prefix, or None
+        """
+        return self.symbols.get(name.removeprefix('CONFIG_'))
+
+    _VALUE_CHECKS = {'bool': lambda value: value in ('y', 'n'),
+                     'tristate': lambda value: value in ('y', 'm', 'n'),
+                     'int': lambda value: re.fullmatch(r'-?[0-9]+', value) is not None,
+                     'hex': lambda value: re.fullmatch(r'(0[xX])?[0-9a-fA-F]+', value) is not None,
+                     'string': lambda value: len(value) >= 2 and value[0] == value[-1] == '"'}
+
+    def validate(self, config):
+        """
+        Checks a mapping of CONFIG_ names to values, such as the values of a merged config
+        Undefined values should be passed as False
+        Returns a list of (name, message) tuples for unknown symbols and values of the wrong type
+        """
+        issues = []
+        for name, value in config.items():
+            if not (symbol := self.get(name)):
+                issues.append((name, "Unknown Kconfig symbol"))
+            elif value is not False and symbol.type and not self._VALUE_CHECKS[symbol.type](value):
+                issues.append((name, f"Invalid value for {symbol.type} symbol: {value}"))
+        return issues
+
+
+_TRISTATE_VALUES = {'n': 0, 'm': 1, 'y': 2}
+_TRISTATE_NAMES = ('n', 'm', 'y')
+_TRISTATE_TYPES = ('bool', 'tristate')
+
+
+class Resolver:
+    """
+    Resolves symbol values in process, like make alldefconfig or allnoconfig with KCONFIG_ALLCONFIG set
+
+    Values passed to resolve are applied to visible symbols, the rest take their defaults,
+    or n for visible bool and tristate symbols in allnoconfig mode
+    Selects raise their targets, implies raise the defaults of their targets, choices keep one member set
+
+    Values are computed in passes until none change
+    Macros, such as $(success,...), are not run, so symbols calculated from one are unknown
+    Unknown symbols keep their value from user_values, those without one are listed in unknown and left out of the result,
+    as are the symbols calculated from them, macro_value is only used in their place while resolving
+    Symbols are output in the order they were parsed, which differs from the menu order used by make
+    """
+    MAX_PASSES = 100
+
+    def __init__(self, symbol_table, allnoconfig=False, macro_value='y'):
+        self.symbol_table = symbol_table
+        self.allnoconfig = allnoconfig
+        self.macro_value = _TRISTATE_VALUES[macro_value]
+        # Maps each symbol name to the (selector name, condition) of the symbols selecting or implying it
+        self.selected_by = {}
+        self.implied_by = {}
+        for symbol in symbol_table.symbols.values():
+            for target, condition in symbol.selects:
+                self.selected_by.setdefault(target, []).append((symbol.name, condition))
+            for target, condition in symbol.implies:
+                self.implied_by.setdefault(target, []).append((symbol.name, condition))
+        # Maps each symbol name to the symbols calculated from its value, and lists the symbols calculated from a macro
+        self._dependents = {}
+        self._macro_symbols = []
+        for symbol in symbol_table.symbols.values():
+            expressions, references = self._calculation_inputs(symbol)
+            if any(expression_has_macro(expression) for expression in expressions):
+                self._macro_symbols.append(symbol.name)
+            for reference in references:
+                self._dependents.setdefault(reference, set()).add(symbol.name)
+        self.values = {}
+        self.user_values = {}
+        self.unknown = set()
+        self._uncertain = set()
+
+    def _calculation_inputs(self, symbol):
+        """
+        Returns the expressions the value of a symbol is calculated from, and the names of the symbols they reference
+        """
+        expressions = [symbol.depends, symbol.prompt_condition]
+        expressions += [expression for default in symbol.defaults for expression in default]
+        expressions += [expression for value_range in symbol.ranges for expression in value_range]
+        expressions += [condition for _, condition in self.selected_by.get(symbol.name, [])]
+        expressions += [condition for _, condition in self.implied_by.get(symbol.name, [])]
+        references = {selector for selector, _ in self.selected_by.get(symbol.name, [])}
+        references |= {implier for implier, _ in self.implied_by.get(symbol.name, [])}
+        if symbol.type in _TRISTATE_TYPES:
+            references.add('MODULES')
+        if (choice := self.symbol_table.choices.get(symbol.choice)) is not None:
+            expressions += [choice.depends, *(expression for default in choice.defaults for expression in default)]
+            expressions += [self.symbol_table.symbols[member].depends for member in choice.symbols
+                            if member in self.symbol_table.symbols]
+            references |= set(choice.symbols)
+        for expression in expressions:
+            references.update(expression_symbols(expression))
+        references.discard(symbol.name)
+        return expressions, references
+
+    def _find_unknown(self):
+        """
+        Sets unknown to the symbols calculated from a macro, directly or through another unknown symbol, without a user value
+        Symbols calculated from a macro which have a user value are uncertain, they keep the user value
+        """
+        self._uncertain = set(self._macro_symbols)
+        pending = list(self._macro_symbols)
+        self.unknown = set()
+        while pending:
+            if (name := pending.pop()) in self.user_values:
+                continue
+            self.unknown.add(name)
+            for dependent in self._dependents.get(name, ()):
+                if dependent not in self._uncertain:
+                    self._uncertain.add(dependent)
+                    pending.append(dependent)
+        if self.unknown:
+            logger.info("Unable to resolve %s Kconfig symbols which depend on macros", len(self.unknown))
+            logger.debug("Symbols depending on macros: %s", ', '.join(sorted(self.unknown)))
+
+    def resolve(self, user_values):
+        """
+        Resolves every symbol, user_values maps names, with or without CONFIG_, to .config values
+        Undefined values may be passed as False or 'n'
+        Returns a dict of symbol name to value for the symbols make would write, n values are 'n'
+        """
+        self.user_values = {name.removeprefix('CONFIG_'): 'n' if value is False else value
+                            for name, value in user_values.items()}
+        self._find_unknown()
+        symbols = self.symbol_table.symbols
+        self.values = {name: 0 if symbol.type in _TRISTATE_TYPES else None for name, symbol in symbols.items()}
+
+        for resolve_pass in range(self.MAX_PASSES):
+            self._choice_selections = {name: self._select_choice(choice) for name, choice in self.symbol_table.choices.items()}
+            changed = False
+            for name, symbol in symbols.items():
+                if (value := self._calculate(symbol)) != self.values[name]:
+                    self.values[name] = value
+                    changed = True
+            if not changed:
+                logger.debug("Kconfig values settled after %s passes", resolve_pass + 1)
+                break
+        else:
+            logger.warning("Kconfig values did not settle after %s passes", self.MAX_PASSES)
+
+        return {name: self._output_value(symbols[name]) for name in symbols
+                if name not in self.unknown and self._is_written(symbols[name])}
+
+    def minimal_values(self, user_values):
+        """
+        Resolves user_values, then returns the values needed to reproduce the result, like make savedefconfig
+        A visible symbol is needed if its value differs from the one it takes without a user value,
+        a choice needs its selected member if that is not the member selected without user values
+        Returns a dict of symbol name to value, n values are 'n'
+        """
+        self.resolve(user_values)
+        minimal = {}
+        for name, symbol in self.symbol_table.symbols.items():
+            if symbol.type is None or symbol.choice is not None or name in self.unknown:
+                continue
+            if name in self._uncertain and name in self.user_values:
+                # The value cannot be calculated without the user value
+                minimal[name] = self._output_value(symbol)
+                continue
+            if not symbol.prompt:
+                continue
+            if min(self.evaluate(symbol.depends), self.evaluate(symbol.prompt_condition)) == 0:
+                continue
+            user_value = self.user_values.pop(name, None)
+            default = self._calculate(symbol)
+            if user_value is not None:
+                self.user_values[name] = user_value
+            if default != self.values[name]:
+                minimal[name] = self._output_value(symbol)
+
+        for name, choice in self.symbol_table.choices.items():
+            if (selection := self._choice_selections.get(name)) is None:
+                continue
+            member_values = {member: self.user_values.pop(member) for member in choice.symbols if member in self.user_values}
+            default = self._select_choice(choice)
+            self.user_values.update(member_values)
+            if default != selection:
+                minimal[selection] = 'y'
+        return minimal
+
+    def _select_choice(self, choice):
+        """
+        Returns the name of the selected member of a choice, or None if the choice is not visible
+        The selection is the member set to y by the user, then the first true default, then the first visible member
+        """
+        if self.evaluate(choice.depends) == 0:
+            return None
+        visible = [name for name in choice.symbols
+                   if name in self.symbol_table.symbols and self.evaluate(self.symbol_table.symbols[name].depends) > 0]
+        for name in visible:
+            if self.user_values.get(name) == 'y':
+                return name
+        for value, condition in choice.defaults:
+            if value[0] == 'sym' and value[1] in visible and self.evaluate(condition) > 0:
+                return value[1]
+        return visible[0] if visible and not choice.optional else None
+
+    def _calculate(self, symbol):
+        """
+        Calculates the value of a symbol from the current values of the others
+        """
+        if symbol.name in self._uncertain and (user_value := self.user_values.get(symbol.name)) is not None:
+            # Macros are not run, so the user value is kept
+            return _TRISTATE_VALUES.get(user_value, 0) if symbol.type in _TRISTATE_TYPES else user_value
+
+        depends = self.evaluate(symbol.depends)
+        visible = min(depends, self.evaluate(symbol.prompt_condition)) if symbol.prompt else 0
+        user_value = self.user_values.get(symbol.name)
+
+        if symbol.type not in _TRISTATE_TYPES:
+            if depends == 0:
+                return None
+            if visible and user_value is not None and self.in_range(symbol, user_value):
+                return user_value
+            for value, condition in symbol.defaults:
+                if self.evaluate(condition) > 0:
+                    return self.string_value(value, symbol.type)
+            return None
+
+        if symbol.choice is not None:
+            value = 2 if self._choice_selections.get(symbol.choice) == symbol.name and depends else 0
+        elif visible and user_value in _TRISTATE_VALUES:
+            value = min(_TRISTATE_VALUES[user_value], visible)
+        elif visible and self.allnoconfig:
+            value = 0
+        else:
+            value = 0
+            for default, condition in symbol.defaults:
+                if (condition_value := self.evaluate(condition)) > 0:
+                    value = min(self.evaluate(default), condition_value)
+                    break
+            value = min(value, depends)
+            implied = max((min(self.values.get(name, 0), self.evaluate(condition))
+                           for name, condition in self.implied_by.get(symbol.name, [])), default=0)
+            value = max(value, min(implied, depends))
+
+        value = max(value, self.reverse_dependency(symbol.name))
+        # Bool symbols, and tristates without module support, cannot be m
+        if value == 1 and (symbol.type == 'bool' or self.values.get('MODULES', 2) == 0):
+            value = 2
+        return value
+
+    def in_range(self, symbol, value):
+        """
+        Checks an int or hex value against the first active range of a symbol, make ignores values outside of it
+        """
+        for low, high, condition in symbol.ranges:
+            if self.evaluate(condition) > 0:
+                try:
+                    return int(self.string_value(low), 0) <= int(value, 0) <= int(self.string_value(high), 0)
+                except (TypeError, ValueError):
+                    return True
+        return True
+
+    def reverse_dependency(self, name):
+        """
+        Returns the minimum value the selects of a symbol force it to
+        """
+        return max((min(self.values.get(selector, 0), self.evaluate(condition))
+                    for selector, condition in self.selected_by.get(name, [])), default=0)
+
+    def _is_written(self, symbol):
+        if symbol.type is None:
+            return False
+        if symbol.name in self._uncertain and symbol.name in self.user_values:
+            return True
+        if symbol.type in _TRISTATE_TYPES:
+            return self.evaluate(symbol.depends) > 0 or self.reverse_dependency(symbol.name) > 0
+        return self.values[symbol.name] is not None
+
+    def _output_value(self, symbol):
+        value = self.values[symbol.name]
+        return _TRISTATE_NAMES[value] if symbol.type in _TRISTATE_TYPES else value
+
+    def string_value(self, expression, symbol_type=None):
+        """
+        Returns the .config string of a value expression, strings are quoted for string symbols
+        """
+        match expression[0]:
+            case 'sym':
+                if (symbol := self.symbol_table.symbols.get(expression[1])) is not None:
+                    value = self.values.get(symbol.name)
+                    return _TRISTATE_NAMES[value] if symbol.type in _TRISTATE_TYPES else value
+                return f'"{expression[1]}"' if symbol_type == 'string' else expression[1]
+            case 'str':
+                return f'"{expression[1]}"' if symbol_type == 'string' else expression[1]
+            case 'macro':
+                return None
+            case _:
+                return _TRISTATE_NAMES[self.evaluate(expression)]
+
+    def evaluate(self, expression):
+        """
+        Evaluates an expression to a tristate, 0 for n, 1 for m and 2 for y
+        """
+        if expression is None:
+            return 2
+        match expression[0]:
+            case 'sym':
+                if (symbol := self.symbol_table.symbols.get(expression[1])) is not None:
+                    return self.values.get(symbol.name) or 0 if symbol.type in _TRISTATE_TYPES else 0
+                return _TRISTATE_VALUES.get(expression[1], 0)
+            case 'str':
+                return _TRISTATE_VALUES.get(expression[1], 0)
+            case 'macro':
+                return self.macro_value
+            case 'not':
+                return 2 - self.evaluate(expression[1])
+            case 'and':
+                return min(self.evaluate(expression[1]), self.evaluate(expression[2]))
+            case 'or':
+                return max(self.evaluate(expression[1]), self.evaluate(expression[2]))
+            case 'cmp':
+                return 2 if self._compare(*expression[1:]) else 0
+
+    def _compare(self, operator, left, right):
+        left_value = (self.string_value(left) or '').strip('"')
+        right_value = (self.string_value(right) or '').strip('"')
+        try:
+            left_value, right_value = int(left_value, 0), int(right_value, 0)
+        except ValueError:
+            pass
+        match operator:
+            case '=':
+                return left_value == right_value
+            case '!=':
+                return left_value != right_value
+        try:
+            return {'<': left_value < right_value, '<=': left_value <= right_value,
+                    '>': left_value > right_value, '>=': left_value >= right_value}[operator]
+        except TypeError:
+            return False
+
+
+def negate_expression(expression):
+    """
+    Returns the negation of an expression, with the not pushed down to symbols and comparisons
+    """
+    match expression[0]:
+        case 'not':
+            return expression[1]
+        case 'and':
+            return ('or', negate_expression(expression[1]), negate_expression(expression[2]))
+        case 'or':
+            return ('and', negate_expression(expression[1]), negate_expression(expression[2]))
+        case 'cmp':
+            operator = {'=': '!=', '!=': '=', '<': '>=', '<=': '>', '>': '<=', '>=': '<'}[expression[1]]
+            return ('cmp', operator, expression[2], expression[3])
+        case _:
+            return ('not', expression)
+
+
+class DependencyExplainer:
+    """
+    Explains why symbols did not take the value they were set to, using the values of a resolved Resolver
+
+    For each symbol, finds the unmet dependency or prompt condition, the selects forcing it,
+    or the choice it lost, and the smallest set of extra option values found which would allow it
+    Requirements are found against the current values, taking the shortest side of each ||,
+    so they are not guaranteed to be the global minimum, and may uncover further dependencies once set
+    """
+    def __init__(self, resolver):
+        self.resolver = resolver
+        self.symbols = resolver.symbol_table.symbols
+
+    def explain(self, name, wanted):
+        """
+        Explains why a symbol did not resolve to the wanted .config value, which is 'n' for undefines
+        Returns a dict with the symbol name, the wanted and actual values, a list of reasons,
+        and the required option values, keyed by name without CONFIG_, or None if none were found
+        """
+        name = name.removeprefix('CONFIG_')
+        explanation = {'name': name, 'wanted': wanted, 'actual': None, 'reasons': [], 'required': {}}
+        if (symbol := self.symbols.get(name)) is None or symbol.type is None:
+            explanation['reasons'].append("Not defined by any Kconfig file")
+            explanation['required'] = None
+            return explanation
+
+        if name in self.resolver.unknown:
+            explanation['reasons'].append("Depends on a Kconfig macro, which is not run, so its value is unknown")
+            explanation['required'] = None
+            return explanation
+
+        explanation['actual'] = self.resolver._output_value(symbol)
+        if symbol.type in _TRISTATE_TYPES:
+            self._explain_tristate(symbol, _TRISTATE_VALUES.get(wanted, 0), explanation)
+        else:
+            self._explain_value(symbol, wanted, explanation)
+        return explanation
+
+    def _explain_tristate(self, symbol, wanted, explanation):
+        reasons = explanation['reasons']
+        actual = self.resolver.values[symbol.name]
+        if wanted > actual:
+            # A bool only needs its dependencies to be m, the value is rounded up
+            needed = 1 if symbol.type == 'bool' else wanted
+            self._explain_unset(symbol, needed, explanation)
+        elif wanted < actual:
+            for selector, condition in self.resolver.selected_by.get(symbol.name, []):
+                if (selected := min(self.resolver.values.get(selector, 0), self.resolver.evaluate(condition))) > wanted:
+                    condition_str = f" if {format_expression(condition)}" if condition else ''
+                    reasons.append(f"Selected to {_TRISTATE_NAMES[selected]} by {selector}{condition_str}")
+                    self._require(explanation, self._requirements(negate_expression(('sym', selector)), 2, {symbol.name}))
+            if wanted == 1 and symbol.type == 'bool':
+                reasons.append("Is a bool symbol, it cannot be m")
+                explanation['required'] = None
+            elif wanted == 1 and self.resolver.values.get('MODULES', 2) == 0:
+                reasons.append("Module support is disabled, tristate symbols cannot be m")
+                self._require(explanation, {'MODULES': 'y'})
+            elif symbol.choice is not None and self.resolver._choice_selections.get(symbol.choice) == symbol.name:
+                reasons.append(f"Is the selected member of choice {symbol.choice}, another member must be set to y")
+            elif not reasons and not self._visible(symbol):
+                reasons.append(f"Has no visible prompt, it takes its default: {_TRISTATE_NAMES[actual]}")
+                explanation['required'] = None
+
+    def _explain_unset(self, symbol, needed, explanation):
+        """
+        Explains why a bool or tristate symbol is lower than needed
+        """
+        reasons = explanation['reasons']
+        if (depends := self.resolver.evaluate(symbol.depends)) < needed:
+            reasons.append(f"Depends on {format_expression(symbol.depends)}, which is {_TRISTATE_NAMES[depends]}")
+            self._require(explanation, self._requirements(symbol.depends, needed, {symbol.name}))
+        elif symbol.choice is not None:
+            selection = self.resolver._choice_selections.get(symbol.choice)
+            reasons.append(f"Is a member of choice {symbol.choice}, which selected: {selection}")
+            if selection is not None and self.resolver.user_values.get(selection) == 'y':
+                reasons.append(f"{selection} is also set to y, only one member of a choice can be set")
+                self._require(explanation, {selection: 'n'})
+        elif not symbol.prompt:
+            reasons.append("Has no prompt, it can only be set by its defaults or by selects")
+            self._require(explanation, self._default_requirements(symbol, needed, {symbol.name}))
+        elif (visible := self.resolver.evaluate(symbol.prompt_condition)) < needed:
+            reasons.append(f"Prompt is only visible if {format_expression(symbol.prompt_condition)}, "
+                           f"which is {_TRISTATE_NAMES[visible]}")
+            self._require(explanation, self._requirements(symbol.prompt_condition, needed, {symbol.name}))
+        elif needed == 2 and self.resolver.values.get('MODULES', 2) == 0:
+            reasons.append("Module support is disabled")
+        elif symbol.name not in self.resolver.user_values:
+            reasons.append("Was not set, it takes its default")
+
+    def _explain_value(self, symbol, wanted, explanation):
+        """
+        Explains why a string, int or hex symbol does not have the wanted value
+        """
+        reasons = explanation['reasons']
+        if (depends := self.resolver.evaluate(symbol.depends)) == 0:
+            reasons.append(f"Depends on {format_expression(symbol.depends)}, which is {_TRISTATE_NAMES[depends]}")
+            self._require(explanation, self._requirements(symbol.depends, 1, {symbol.name}))
+        elif not self._visible(symbol):
+            condition = f" if {format_expression(symbol.prompt_condition)}" if symbol.prompt else ''
+            reasons.append(f"Has no visible prompt{condition}, it takes its default")
+            if symbol.prompt:
+                self._require(explanation, self._requirements(symbol.prompt_condition, 1, {symbol.name}))
+            else:
+                explanation['required'] = None
+        for low, high, condition in symbol.ranges:
+            if self.resolver.evaluate(condition) > 0:
+                if not self.resolver.in_range(symbol, wanted):
+                    low_value, high_value = self.resolver.string_value(low), self.resolver.string_value(high)
+                    reasons.append(f"Is outside of the range: {low_value} - {high_value}")
+                    explanation['required'] = None
+                break
+
+    def _visible(self, symbol):
+        return bool(symbol.prompt) and min(self.resolver.evaluate(symbol.depends),
+                                           self.resolver.evaluate(symbol.prompt_condition)) > 0
+
+    @staticmethod
+    def _require(explanation, requirements):
+        """
+        Adds requirements to an explanation, None marks the explanation as having no known fix
+        """
+        if explanation['required'] is None:
+            return
+        if requirements is None:
+            explanation['required'] = None
+        elif (merged := DependencyExplainer._merge(explanation['required'], requirements)) is None:
+            explanation['required'] = None
+        else:
+            explanation['required'] = merged
+
+    @staticmethod
+    def _merge(left, right):
+        """
+        Merges two requirement dicts, returns None if either is None or they conflict
+        """
+        if left is None or right is None:
+            return None
+        if any(left[name] != value for name, value in right.items() if name in left):
+            return None
+        return left | right
+
+    def _requirements(self, expression, needed, seen):
+        """
+        Returns the option values needed to raise an expression to at least needed,
+        or None if no values were found, seen holds the symbols already being raised
+        """
+        if self.resolver.evaluate(expression) >= needed:
+            return {}
+        match expression[0]:
+            case 'sym':
+                return self._symbol_requirements(expression[1], _TRISTATE_NAMES[needed], seen)
+            case 'and':
+                return self._merge(self._requirements(expression[1], needed, seen),
+                                   self._requirements(expression[2], needed, seen))
+            case 'or':
+                options = [requirements for side in expression[1:]
+                           if (requirements := self._requirements(side, needed, seen)) is not None]
+                return min(options, key=len, default=None)
+            case 'not':
+                match expression[1][0]:
+                    case 'sym':
+                        return self._symbol_requirements(expression[1][1], 'n', seen)
+                    case 'not' | 'and' | 'or' | 'cmp':
+                        return self._requirements(negate_expression(expression[1]), needed, seen)
+                # Negated macros and strings cannot be changed by setting options
+                return None
+            case 'cmp':
+                operator, left, right = expression[1:]
+                if operator != '=' or left[0] != 'sym' or left[1] not in self.symbols:
+                    return None
+                value = f'"{right[1]}"' if self.symbols[left[1]].type == 'string' else right[1]
+                return self._symbol_requirements(left[1], value, seen)
+        return None
+
+    def _symbol_requirements(self, name, value, seen):
+        """
+        Returns the option values needed to set a symbol to value, including the symbol itself if it has a prompt
+        """
+        if (symbol := self.symbols.get(name)) is None or name in seen:
+            return None
+        seen = seen | {name}
+        if symbol.type not in _TRISTATE_TYPES:
+            if not symbol.prompt:
+                return None
+            return self._merge({name: value}, self._requirements(symbol.depends, 1, seen))
+
+        if symbol.type == 'bool' and value == 'm':
+            value = 'y'
+        wanted = _TRISTATE_VALUES.get(value, 0)
+        if wanted == 0:
+            # Lowering a symbol needs it unset, and every active select of it removed
+            if not symbol.prompt and self.resolver.values[name] > self.resolver.reverse_dependency(name):
+                # Set by its own defaults
+                return None
+            requirements = {name: 'n'} if symbol.prompt else {}
+            for selector, condition in self.resolver.selected_by.get(name, []):
+                if min(self.resolver.values.get(selector, 0), self.resolver.evaluate(condition)) > 0:
+                    requirements = self._merge(requirements, self._symbol_requirements(selector, 'n', seen))
+            return requirements
+        if not symbol.prompt:
+            return self._default_requirements(symbol, wanted, seen)
+        needed = 1 if symbol.type == 'bool' else wanted
+        requirements = self._merge(self._requirements(symbol.depends, needed, seen),
+                                   self._requirements(symbol.prompt_condition, needed, seen))
+        return self._merge({name: value}, requirements)
+
+    def _default_requirements(self, symbol, needed, seen):
+        """
+        Returns the option values needed to raise a symbol without a prompt,
+        through one of its selects, or a default with a true value
+        """
+        sources = [('and', ('sym', selector), condition) if condition else ('sym', selector)
+                   for selector, condition in self.resolver.selected_by.get(symbol.name, [])]
+        sources += [('and', symbol.depends, condition) if condition else symbol.depends
+                    for default, condition in symbol.defaults
+                    if self.resolver.evaluate(default) >= needed and (condition or symbol.depends)]
+        options = [requirements for source in sources
+                   if (requirements := self._requirements(source, needed, seen)) is not None]
+        return min(options, key=len, default=None)
@@ -7,10 +7,53 @@ __author__ = "desultory"
 __version__ = "0.2.2"
 
 from custom_logging import class_logger
+from kconfig import SymbolTable
+from pickle_cache import PickleCache
 
 from collections import OrderedDict
-from re import search
-from yaml import safe_load
+from functools import cached_property
+from hashlib import sha256
+from re import compile as compile_pattern
+from yaml import load
+import os
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+DEFAULT_CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'kernel_config')
+DEFAULT_CACHE_SIZE = 64 * 1024 * 1024
+
+
+@class_logger
+class YamlLoader:
+    """
+    Loads yaml files using the libyaml safe loader when it is available, otherwise the pure python safe loader
+
+    Parsed files are cached in cache_dir as pickles, keyed by a hash of the file contents,
+    the least recently used entries are evicted once they total more than max_size bytes, see PickleCache
+    If cache_dir is None, or is not owned by the current user with mode 0700, files are always parsed
+    """
+    _CACHE_VERSION = b'1'
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_size=DEFAULT_CACHE_SIZE, *args, **kwargs):
+        self.cache = PickleCache(cache_dir, max_size, self.logger) if cache_dir else None
+
+    def load(self, file_name):
+        """ Returns the parsed contents of a yaml file """
+        with open(file_name, 'rb') as yaml_file:
+            contents = yaml_file.read()
+        if not self.cache:
+            return load(contents, Loader=SafeLoader)
+
+        key = sha256(b"\0".join([self._CACHE_VERSION, SafeLoader.__name__.encode(), contents])).hexdigest()
+        entry_path = self.cache.path(key)
+        if (parsed := self.cache.get(entry_path, file_name)) is not None:
+            return parsed
+        parsed = load(contents, Loader=SafeLoader)
+        self.cache.put(entry_path, file_name, parsed)
+        return parsed
 
 
 @class_logger
@@ -27,9 +70,13 @@ class LinuxKernelConfigParameter:
     defined is assumed to be true if it's not specified.
 
     This object can be printed for a representation of how it would be defined in a .config file
+    Instances keep a __dict__, rather than __slots__, as class_logger wraps the class in a subclass,
+    and instances may set their own logger and an optional description
     """
     _invalid_name_chars = r'[^a-zA0-Z_0-9]'
     _valid_value_chars = r'(-?([0-9])+|[ynm]+|"([a-zA-Z0-9/_.,-=\(\) ])*")$'
+    _invalid_name_pattern = compile_pattern(_invalid_name_chars)
+    _valid_value_pattern = compile_pattern(_valid_value_chars)
 
     components = OrderedDict({'name': {'required': True},
                               'defined': {'required': True, 'default': True},
@@ -38,19 +85,59 @@ class LinuxKernelConfigParameter:
 
     def __init__(self, *args, **kwargs):
         for component_name, specification in self.components.items():
-            self.logger.debug("Checking kwargs for component: %s" % component_name)
-            self.logger.debug("Kwarg value: %s" % kwargs.get(component_name))
+            self.logger.debug("Checking kwargs for component: %s", component_name)
+            self.logger.debug("Kwarg value: %s", kwargs.get(component_name))
             value = kwargs.pop(component_name, specification.get('default'))
-            self.logger.debug("Computed value: %s" % value)
+            self.logger.debug("Computed value: %s", value)
             if specification.get('required') or value is not None:
                 setattr(self, component_name, value)
 
         while kwargs:
             self.logger.warning("Unable to process kwarg: %s=%s" % kwargs.popitem())
 
+    @classmethod
+    def from_entries(cls, entries, logger=None):
+        """
+        Creates a parameter for each (name, value, description) tuple, such as the options of a yaml definition file
+        A value of None makes the parameter an undefine, description may be None
+
+        Skips the per attribute validation and logging of __init__, but checks every name and value the same way,
+        all invalid entries are reported in a single ValueError
+        """
+        parameters = []
+        errors = []
+        shared_logger = cls.child_logger(logger) if logger else None
+        invalid_name = cls._invalid_name_pattern.search
+        valid_value = cls._valid_value_pattern.search
+        set_attribute = object.__setattr__
+        for name, value, description in entries:
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                value = str(value)
+            if not isinstance(name, str) or invalid_name(name):
+                errors.append(f"Invalid name: {name}")
+                continue
+            if value is not None and (not isinstance(value, str) or not valid_value(value)):
+                errors.append(f"Invalid value for {name}: {value}")
+                continue
+
+            name = name.upper()
+            parameter = object.__new__(cls)
+            if shared_logger:
+                set_attribute(parameter, 'logger', shared_logger)
+            set_attribute(parameter, 'name', name if name.startswith("CONFIG_") else f"CONFIG_{name}")
+            set_attribute(parameter, 'defined', value is not None)
+            set_attribute(parameter, 'value', value)
+            if description is not None:
+                set_attribute(parameter, 'description', description)
+            parameters.append(parameter)
+
+        if errors:
+            raise ValueError("Invalid config parameters:\n%s" % "\n".join(errors))
+        return parameters
+
     def __setattr__(self, name, value):
         if isinstance(value, (int, float)) and not isinstance(value, bool):
-            self.logger.debug("Making value a string: %s" % value)
+            self.logger.debug("Making value a string: %s", value)
             value = str(value)
         if hasattr(self, f"_validate_{name}") and not getattr(self, f"_validate_{name}")(value):
             raise ValueError(f"Invalid {name}: {value}")
@@ -72,7 +159,7 @@ class LinuxKernelConfigParameter:
     @staticmethod
     def _validate_name(name):
         """ Validates the characters in a kernel config parameter name """
-        return not search(LinuxKernelConfigParameter._invalid_name_chars, name)
+        return not LinuxKernelConfigParameter._invalid_name_pattern.search(name)
 
     def _validate_value(self, value):
         """
@@ -83,43 +170,107 @@ class LinuxKernelConfigParameter:
         """
         if self.defined is False:
             return True
-        return True if search(self._valid_value_chars, value) else False
+        return True if self._valid_value_pattern.search(value) else False
 
     def __str__(self):
         """ Returns a string representation of how this kernel config should be specified in a kernel .config """
         return f"{self.name}={self.value}" if self.defined else f"# {self.name} is not set"
 
 
-@class_logger
+@class_logger(per_instance=True)
 class KConfig:
     """
     Parses and represents KConfig information
+    The kernel tree is indexed when the symbol table is first used
     """
-    _KCONFIG_FILE_REGEX = r'/(Kconfig)(\.|-)?([a-zA-Z0-9])*$'
-    excluded_search_dirs = ['Documentation']
-
     def __init__(self, index_dir='/usr/src/linux/', *args, **kwargs):
         self.index_dir = index_dir
-        self.kconfig_files = list()
 
-        self.index_files()
-        print(self.kconfig_files)
+    @cached_property
+    def symbol_table(self):
+        return self.index_files()
+
+    @property
+    def kconfig_files(self):
+        return list(self.symbol_table.files)
 
     def index_files(self):
-        from os import scandir
-        subdirs = [subdir.path for subdir in scandir(self.index_dir) if subdir.path.replace(self.index_dir, '') not in self.excluded_search_dirs and subdir.is_dir()]
-        self.logger.debug("Detected KConfig subdirectories: %s" % subdirs)
-        for subdir in subdirs:
-            self.logger.debug("Scanning directory for Kconfig files: %s", subdir)
-            found_kconfigs = [subdir + search(self._KCONFIG_FILE_REGEX, file.path).group() for file in scandir(subdir) if search(self._KCONFIG_FILE_REGEX, file.path)]
-            if not found_kconfigs:
-                self.logger.debug("Did not find any Kconfig files in: %s", subdir)
-            else:
-                self.logger.info("Discovered KConfigs: %s", found_kconfigs)
-                self.kconfig_files.append(found_kconfigs)
+        """ Indexes the Kconfig files and symbols of the kernel tree, following source statements """
+        symbol_table = SymbolTable.load(self.index_dir)
+        self.logger.info("Indexed %s Kconfig symbols from %s files" % (len(symbol_table.symbols), len(symbol_table.files)))
+        return symbol_table
 
 
 @class_logger
+class ConditionEngine:
+    """
+    Evaluates the 'if' conditions of definition file entries against config values, such as the features in config.yaml
+
+    Conditions are compiled from their yaml form into hashable tuples:
+        {'value': 'ipv6', 'in': 'features'} -> ('in', 'features', 'ipv6')
+        {'and': [conditions]}, {'or': [conditions]}, {'not': condition}
+        A list of conditions is true if any of them is, as with the 'if' list of an entry
+
+    Config values are only indexed once a condition refers to them, lists are indexed as frozensets,
+    values which cannot be hashed are checked as they are
+    The result of each distinct condition, including nested conditions, is memoized
+    A missing config value raises a KeyError
+    """
+    def __init__(self, config_values, *args, **kwargs):
+        self.config_values = config_values or {}
+        self.index = {}
+        self._results = {}
+
+    def _indexed(self, name):
+        """ Returns the config value to run 'in' checks against, indexing it on first use """
+        try:
+            return self.index[name]
+        except KeyError:
+            pass
+        value = self.config_values[name]
+        if isinstance(value, (dict, list, tuple, set)):
+            try:
+                value = frozenset(value)
+            except TypeError:
+                pass
+        self.index[name] = value
+        return value
+
+    @classmethod
+    def compile(cls, condition):
+        """ Compiles the yaml form of a condition into a hashable tuple """
+        if isinstance(condition, list):
+            return ('or', tuple(cls.compile(item) for item in condition))
+        if not isinstance(condition, dict):
+            raise ValueError("Invalid condition: %s" % condition)
+        if 'in' in condition:
+            return ('in', condition['in'], condition['value'])
+        if 'not' in condition:
+            return ('not', cls.compile(condition['not']))
+        for operator in ('and', 'or'):
+            if operator in condition:
+                return (operator, tuple(cls.compile(item) for item in condition[operator]))
+        raise ValueError("Invalid condition: %s" % condition)
+
+    def evaluate(self, condition):
+        """ Evaluates a compiled condition, each distinct condition is only evaluated once """
+        if (result := self._results.get(condition)) is None:
+            result = self._results[condition] = self._evaluate(condition)
+        return result
+
+    def _evaluate(self, condition):
+        match condition[0]:
+            case 'in':
+                return condition[2] in self._indexed(condition[1])
+            case 'not':
+                return not self.evaluate(condition[1])
+            case 'and':
+                return all(self.evaluate(item) for item in condition[1])
+            case 'or':
+                return any(self.evaluate(item) for item in condition[1])
+
+
+@class_logger(per_instance=True)
 class KernelDict(dict):
     """
     Special dictionary for linux kernel config
@@ -133,14 +284,19 @@ class KernelDict(dict):
     """
     def __init__(self, config_values, *args, **kwargs):
         self._config_values = config_values
+        self._conditions = ConditionEngine(config_values)
+        # Maps the id of each checked condition to the (condition, compiled condition)
+        self._compiled = {}
 
     def __setitem__(self, key, value):
         """
         Tries to generate a new linux kernel config parameter based on the supplied information
         passes it to the update function which should handle merging
+        Raises a ValueError if all tests of the entry failed
         """
 
-        config_parameter = self.gen_config_obj_from_dict(key, value)
+        if (config_parameter := self.gen_config_obj_from_dict(key, value)) is None:
+            raise ValueError("All tests failed for entry %r" % key)
         self.update_value(config_parameter)
 
     def gen_config_obj_from_dict(self, name, config_values):
@@ -155,20 +311,42 @@ class KernelDict(dict):
         if config_values is None:
             kwargs['defined'] = False
 
-        if isinstance(config_values, dict):
-            self.logger.info("Advanced config detected for config: %s" % name)
-            self.logger.debug("Config: %s" % config_values)
-            kwargs['value'] = config_values['value']
-            if 'description' in config_values:
-                kwargs['description'] = config_values['description']
-            if 'if' in config_values:
-                if True not in [self.check_expression(expression) for expression in config_values['if']]:
-                    self.logger.warning("All tests failed for: %s" % config_values)
-                    return
-        else:
-            kwargs['value'] = config_values
+        if (entry := self._parse_entry(name, config_values)) is None:
+            return
+        _, kwargs['value'], description = entry
+        if description is not None:
+            kwargs['description'] = description
         return LinuxKernelConfigParameter(**kwargs)
 
+    def _parse_entry(self, name, config_values):
+        """
+        Returns the (name, value, description) of a definition file entry, or None if all of its tests fail
+        """
+        if not isinstance(config_values, dict):
+            return name, config_values, None
+
+        self.logger.info("Advanced config detected for config: %s" % name)
+        self.logger.debug("Config: %s" % config_values)
+        if 'if' in config_values:
+            if not self.check_expression(config_values['if']):
+                self.logger.warning("All tests failed for: %s" % config_values)
+                return
+        return name, config_values['value'], config_values.get('description')
+
+    def update_from_mapping(self, config):
+        """
+        Adds every entry of a loaded definition file, using the bulk LinuxKernelConfigParameter.from_entries path
+        Raises a ValueError if all tests of an entry failed, like __setitem__,
+        every entry is checked and validated before any is added
+        """
+        entries = []
+        for name, config_values in config.items():
+            if (entry := self._parse_entry(name, config_values)) is None:
+                raise ValueError("All tests failed for entry %r" % name)
+            entries.append(entry)
+        for parameter in LinuxKernelConfigParameter.from_entries(entries, logger=self.logger):
+            self.update_value(parameter)
+
     def update_value(self, value):
         """
         Updates a dict key to a valid LinuxKernelConfigParameter object
@@ -182,25 +360,28 @@ class KernelDict(dict):
         super().__setitem__(value.name, value)
 
     def check_expression(self, expression):
-        self.logger.debug("Checking expression: %s" % expression)
-        if 'in' in expression:
-            value = expression['value']
-            config = self._config_values[expression['in']]
-            self.logger.debug("Checking that '%s' is in list: %s" % (value, config))
-            return True if value in config else False
-        return False
+        """
+        Checks a condition, or a list of conditions of which any may be true, see ConditionEngine
+        Conditions are compiled once per object, so conditions shared through yaml anchors are only compiled once
+        """
+        self.logger.debug("Checking expression: %s", expression)
+        if (compiled := self._compiled.get(id(expression))) is None or compiled[0] is not expression:
+            # The condition is kept with its compiled form, so its id is not reused while cached
+            compiled = self._compiled[id(expression)] = (expression, ConditionEngine.compile(expression))
+        return self._conditions.evaluate(compiled[1])
 
     def __str__(self):
         return "".join([f"{str(parameter)}\n" for parameter in self.values()])
 
 
-@class_logger
+@class_logger(per_instance=True)
 class LinuxKernelConfig:
     """
     Abstraction of a collection of 'LinuxKernelConfigParameter's
     """
     def __init__(self, config_file, *args, **kwargs):
         self.kconfig = KConfig()
+        self.yaml_loader = YamlLoader(cache_dir=kwargs.get('cache_dir', DEFAULT_CACHE_DIR), logger=self.logger)
         self.load_config(config_file)
         self.config_parameters = KernelDict(self.config)
 
@@ -214,9 +395,8 @@ class LinuxKernelConfig:
 
     def load_config(self, file_name: str):
         """ Loads the config from a file """
-        with open(file_name, 'r') as config_file:
-            self.logger.info("Loading config from file: %s" % config_file.name)
-            self.config = safe_load(config_file)
+        self.logger.info("Loading config from file: %s" % file_name)
+        self.config = self.yaml_loader.load(file_name)
 
     def from_config_files(self, file_names: list):
         """ Parses each file name, in the order it's defined in the list """
@@ -225,9 +405,7 @@ class LinuxKernelConfig:
 
     def from_config_file(self, file_name: str):
         """ Parses a yaml file into the current loaded kernel config """
-        with open(file_name, 'r') as config_file:
-            file_contents = safe_load(config_file)
-            for name, value in file_contents.items():
-                self.logger.debug("Processing parameter '%s' with value: %s" % (name, value))
-                self.config_parameters[name] = value
+        file_contents = self.yaml_loader.load(file_name)
+        self.logger.debug("Processing %s parameters from: %s" % (len(file_contents), file_name))
+        self.config_parameters.update_from_mapping(file_contents)
 
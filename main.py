@@ -21,7 +21,12 @@ if __name__ == '__main__':
                            action='store',
                            help='Kernel config definition file(s)')
 
+    argparser.add_argument('--no-cache',
+                           action='store_true',
+                           help='Parse the yaml files without using the parsed yaml cache')
+
     args = argparser.parse_args()
 
-    kconfig = LinuxKernelConfig(args.config, kernel_config_files=args.kernel_configs)
+    kconfig = LinuxKernelConfig(args.config, kernel_config_files=args.kernel_configs,
+                                **({'cache_dir': None} if args.no_cache else {}))
 
@@ -7,17 +7,35 @@ Can process the file with/without make
 
 """
 
-from enum import Enum
+from collections.abc import MutableMapping
+from concurrent.futures import ProcessPoolExecutor
+from enum import Enum, IntEnum
+from functools import cache
+from hashlib import sha256
+from io import BytesIO
+from mmap import mmap, ACCESS_READ
+from stat import S_IMODE, S_ISREG
+from sys import intern
+from tempfile import mkstemp, TemporaryDirectory
+from time import perf_counter, sleep
 import argparse
+import asyncio
+import filecmp
+import json
 import logging
 import os
 import subprocess
 import re
 
 from ColorLognameFormatter import ColorLognameFormatter
+from kconfig import DependencyExplainer, Resolver, SymbolTable
+from pickle_cache import PickleCache
 
 DEFAULT_CONFIG_FILE = 'arch/x86/configs/x86_64_defconfig'
 DEFAULT_OUT_FILE = '.config'
+DEFAULT_CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'merge_config')
+DEFAULT_CACHE_SIZE = 64 * 1024 * 1024
+DEFAULT_WATCH_INTERVAL = 0.2
 
 
 logger = logging.getLogger(__name__)
@@ -28,12 +46,44 @@ stdout_handler.setFormatter(ColorLognameFormatter())
 logger.addHandler(stdout_handler)
 logger.propagate = False
 
+kconfig_logger = logging.getLogger('kconfig')
+kconfig_logger.addHandler(stdout_handler)
+kconfig_logger.propagate = False
 
-class ParserWarning(Exception):
-    pass
+
+def write_file(file_name, lines):
+    """
+    Streams lines into a temporary file next to file_name, then atomically renames it over file_name
+    If file_name already has identical contents it is left untouched, preserving its mtime
+    If file_name is a symlink, its target is written, new files are created with the mode allowed by the umask
+    Returns True if the file was written
+    """
+    file_name = os.path.realpath(file_name)
+    fd, temp_file_name = mkstemp(dir=os.path.dirname(os.path.abspath(file_name)),
+                                 prefix=f".{os.path.basename(file_name)}.",
+                                 suffix='.tmp')
+    try:
+        with open(fd, 'w') as temp_file:
+            temp_file.writelines(lines)
+        if os.path.isfile(file_name):
+            if filecmp.cmp(temp_file_name, file_name, shallow=False):
+                logger.debug("File contents are unchanged, not writing: %s", file_name)
+                os.remove(temp_file_name)
+                return False
+            os.chmod(temp_file_name, S_IMODE(os.stat(file_name).st_mode))
+        else:
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(temp_file_name, 0o666 & ~umask)
+        os.replace(temp_file_name, file_name)
+    except BaseException:
+        if os.path.exists(temp_file_name):
+            os.remove(temp_file_name)
+        raise
+    return True
 
 
-class ParserError(Exception):
+class ParserWarning(Exception):
     pass
 
 
@@ -43,94 +93,127 @@ class ConfigLineTypes(Enum):
     INVALID = 3
 
 
+class ConfigValueCodes(IntEnum):
+    """
+    Small integer codes for the common config values
+    Values which are not tristates are compared by their string value
+    """
+    OTHER = 0
+    UNSET = 1
+    YES = 2
+    MODULE = 3
+    NO = 4
+
+
 class KernelConfigParameter:
     """
     A single kernel configuration parameter
     """
     _CONFIG_REGEX = re.compile(r'(CONFIG)([a-zA-Z0-9_])+')
-    _DEFINE_REGEX = r'^([a-zA-Z0-9_])+=(-?([0-9])+|[ynm]+|"([a-zA-Z0-9/_.,-=\(\) ])*")$'
-    _UNDEFINE_REGEX = re.compile(r"^(# CONFIG_)([a-zA-Z0-9_]+)( is not set)$")
-
-    name = ''
-    value = ''
-    define_type = ConfigLineTypes.INVALID
+    # Matches either a definition or an undefinition in a single scan
+    # Defines populate the name and value groups, undefines populate the undefine group
+    _LINE_REGEX = re.compile(r'(?P<name>[a-zA-Z0-9_]+)=(?P<value>-?[0-9]+|[ynm]+|"[a-zA-Z0-9/_.,-=\(\) ]*")'
+                             r'|# (?P<undefine>CONFIG_[a-zA-Z0-9_]+) is not set')
 
-    def __init__(self, raw_config_line):
-        self.raw_config_line = raw_config_line
-        logger.debug("Set the raw config line to: %s", raw_config_line)
+    _VALUE_CODES = {'y': ConfigValueCodes.YES,
+                    'm': ConfigValueCodes.MODULE,
+                    'n': ConfigValueCodes.NO}
 
-        self.parse_line()
+    # Parameters are held by the thousand, avoid a per-instance __dict__
+    __slots__ = ('name', 'value', 'value_code', 'define_type', 'raw_config_line', 'line_number')
 
-    def clean_line(self):
+    def __init__(self, raw_config_line, keep_raw=False, line_number=None):
         """
-        Strips unwanted characters from the input config line, sets config_line
+        Parses the raw config line
+        The raw line is only retained when keep_raw is True
+        The line number is the position of the line in its source, if known
         """
-        self.config_line = self.raw_config_line.rstrip()
-        logger.debug("Clean Line: %s", self.config_line)
+        self.raw_config_line = raw_config_line if keep_raw else None
+        self.line_number = line_number
+        self.parse_line(raw_config_line)
 
-    def classify_line(self):
+    @classmethod
+    def _match(cls, config_line):
         """
-        Classifies a line as a define, undefine or invalid
+        Classifies and splits a stripped config line in a single pass
+        Returns a tuple of (define_type, name, value), or None if the line is not a config parameter
         """
-        # Check that the line contains expected config syntax
-        if not re.search(self._CONFIG_REGEX, self.config_line):
-            raise ParserWarning(f"The following line does not seem to contain a kernel .config parameter: {self.config_line}")
-            self.define_type = ConfigLineTypes.INVALID
-        elif re.match(self._DEFINE_REGEX, self.config_line):
-            self.define_type = ConfigLineTypes.DEFINE
-        elif re.match(self._UNDEFINE_REGEX, self.config_line):
-            self.define_type = ConfigLineTypes.UNDEFINE
-        else:
-            raise ParserWarning(f"Unable to interpret config parameter: {self.config_line}")
-
-    def parse_line(self):
+        # Blank lines and plain comments make up much of most fragments, skip them before the regex
+        if not config_line or config_line[0] == '#' and not config_line.startswith('# CONFIG_'):
+            return None
+        if match := cls._LINE_REGEX.fullmatch(config_line):
+            name, value, undefine = match.group('name', 'value', 'undefine')
+            if undefine:
+                return ConfigLineTypes.UNDEFINE, undefine, False
+            # Defines must still reference a CONFIG option, the name nearly always starts with it
+            if name.startswith('CONFIG_') or cls._CONFIG_REGEX.search(config_line):
+                return ConfigLineTypes.DEFINE, name, value
+
+    @classmethod
+    def skip_reason(cls, raw_config_line):
         """
-        Attempts to parse self.config_line based on self.define_type
+        Returns a message explaining why a line is not a config parameter
         """
-        self.clean_line()
-        self.classify_line()
-        match self.define_type:
-            case ConfigLineTypes.DEFINE:
-                return self.parse_define()
-            case ConfigLineTypes.UNDEFINE:
-                return self.parse_undefine()
-            case ConfigLineTypes.INVALID:
-                raise ParserWarning("Attempting to call parse line when the define type is invald")
+        config_line = raw_config_line.rstrip()
+        if not cls._CONFIG_REGEX.search(config_line):
+            return f"The following line does not seem to contain a kernel .config parameter: {config_line}"
+        return f"Unable to interpret config parameter: {config_line}"
 
-    def parse_define(self):
+    @classmethod
+    def tokenize(cls, raw_config_line):
         """
-        Attempts to parse a config definition
-        Sets the name and value of the config line
+        Classifies and splits a raw config line in a single pass
+        Returns a tuple of (define_type, name, value)
+        Raises a ParserWarning if the line is not a kernel config parameter
         """
-        self.strip_comment()
-        if not re.match(self._DEFINE_REGEX, self.config_line):
-            raise ParserError(f"The input line failed the definition regex: {self.config_line}")
+        if tokens := cls._match(raw_config_line.rstrip()):
+            return tokens
+        raise ParserWarning(cls.skip_reason(raw_config_line))
 
-        self.name, _, self.value = self.config_line.partition('=')
-        logger.debug("Set name: %s", self.name)
-        logger.debug("Set value: %s", self.value)
-
-    def strip_comment(self):
+    @classmethod
+    def from_line(cls, raw_config_line, keep_raw=False, line_number=None):
+        """
+        Returns a parameter for the raw config line, or None if it is not a config parameter
+        Unlike the constructor, this never raises or logs, for use on the parsing hot path
         """
-        Removes comments from the config line
+        if not (tokens := cls._match(raw_config_line.rstrip())):
+            return None
+        parameter = cls.__new__(cls)
+        parameter.raw_config_line = raw_config_line if keep_raw else None
+        parameter.line_number = line_number
+        parameter._set_tokens(*tokens)
+        return parameter
+
+    def parse_line(self, raw_config_line):
         """
-        if '#' in self.config_line:
-            logger.debug("Comment detected, removing: %s", self.config_line)
-            self.config_line = self.config_line[:self.config_line.find('#')].strip()
-            logger.debug("Processed line: %s", self.config_line)
+        Parses the raw config line, sets the define type, name and value
+        """
+        self._set_tokens(*self.tokenize(raw_config_line))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Parsed %s: %s", self.define_type.name, self)
 
-    def parse_undefine(self):
+    def _set_tokens(self, define_type, name, value):
         """
-        Attempts to parse a config undefinition
-        Sets the name of the config variable
+        Sets the define type, name and value
+        Names and values are interned so equal values share a single object
         """
-        if not re.match(self._UNDEFINE_REGEX, self.config_line):
-            raise ParserError(f"The input line failed the undefinition regex: {self.config_line}")
+        self.define_type = define_type
+        self.name = intern(name)
+        if define_type == ConfigLineTypes.UNDEFINE:
+            self.value = value
+            self.value_code = ConfigValueCodes.UNSET
+        else:
+            self.value = intern(value)
+            self.value_code = self._VALUE_CODES.get(value, ConfigValueCodes.OTHER)
 
-        logger.debug("Parsing line: %s", self.config_line)
-        self.name = "CONFIG_" + re.search(self._UNDEFINE_REGEX, self.config_line).group(2)
-        logger.debug("Detected undefine for variable: %s", self.name)
-        self.value = False
+    def same_value(self, other):
+        """
+        Checks if another parameter has the same value as this one
+        Tristates and undefines are compared by their value code
+        """
+        if self.value_code != other.value_code:
+            return False
+        return self.value_code != ConfigValueCodes.OTHER or self.value == other.value
 
     def __str__(self):
         """
@@ -142,17 +225,223 @@ class KernelConfigParameter:
             case ConfigLineTypes.UNDEFINE:
                 return f"# {self.name} is not set"
             case ConfigLineTypes.INVALID:
-                return self.config_line
+                return self.raw_config_line or ''
+
+
+class ParsedConfigCache(PickleCache):
+    """
+    On-disk cache of parsed kernel config files
+
+    Entries are keyed by the path, size, mtime and content hash of the source file
+    The least recently used entries are evicted once the cache grows past max_size bytes
+    Entries are pickles, so they are only loaded from a directory private to the current user
+    """
+    _CACHE_VERSION = 2
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_size=DEFAULT_CACHE_SIZE):
+        super().__init__(cache_dir, max_size, logger)
+        logger.debug("Set the cache directory to: %s", self.cache_dir)
+        logger.debug("Set the max cache size to: %s", self.max_size)
+
+    def entry_path(self, config_file_name, file_stat, content):
+        """
+        Returns the cache entry path for a config file, given its stat result and contents
+        """
+        # The module is part of the key so entries pickled from __main__ are not loaded on import
+        key = "\0".join([str(self._CACHE_VERSION),
+                         KernelConfigParameter.__module__,
+                         os.path.abspath(config_file_name),
+                         str(file_stat.st_size),
+                         str(file_stat.st_mtime_ns),
+                         sha256(content).hexdigest()])
+        return self.path(sha256(key.encode()).hexdigest())
+
+
+class LayeredConfig(MutableMapping):
+    """
+    A mapping of config parameters stored as layers over a base mapping
+
+    Writes go to the top layer, so each layer only holds the names it changed
+    An index of the layer holding each changed name keeps lookups O(1) regardless of depth
+    Iteration order matches a dict which had every layer applied to it in order
+    Layers can be pushed, popped and rolled back without copying the base, the base must not be changed
+    Read only views of the bottom layers can be taken with view
+    """
+    def __init__(self, base=None, label='base', read_only=False):
+        self.base = {} if base is None else base
+        self.labels = [label]
+        self.layers = []
+        self.read_only = read_only
+        # Maps each name defined in a layer to the index of the top layer defining it
+        self._index = {}
+        # The number of names in the index which are not in the base
+        self._added = 0
+        # The flattened config, built on the first iteration then kept up to date by writes
+        self._flat = None
+
+    def _check_writable(self):
+        if self.read_only:
+            raise TypeError("LayeredConfig views are read only")
+
+    def _index_name(self, name, layer_index):
+        """
+        Points the index of a name at a layer, names new to the index are added after all others
+        """
+        if name not in self._index and name not in self.base:
+            self._added += 1
+        self._index[name] = layer_index
+
+    def _reindex_name(self, name, depth):
+        """
+        Points the index of a name at the top layer below depth defining it, or the base
+        Existing entries are updated in place so the iteration order does not change
+        """
+        for layer_index in range(depth - 1, -1, -1):
+            if name in (layer := self.layers[layer_index]):
+                self._index[name] = layer_index
+                if self._flat is not None:
+                    self._flat[name] = layer[name]
+                return
+        del self._index[name]
+        if name in self.base:
+            if self._flat is not None:
+                self._flat[name] = self.base[name]
+            return
+        self._added -= 1
+        if self._flat is not None:
+            del self._flat[name]
+
+    def push_layer(self, label):
+        """
+        Adds an empty layer on top, future writes are stored in it
+        Returns the depth of the new layer
+        """
+        self._check_writable()
+        self.layers.append({})
+        self.labels.append(label)
+        return len(self.layers)
+
+    def pop_layer(self):
+        """
+        Removes and returns the top layer as a (label, dict) tuple
+        Names it defined fall back to the next layer defining them
+        """
+        self._check_writable()
+        if not self.layers:
+            raise IndexError("There are no layers to pop")
+        layer = self.layers.pop()
+        label = self.labels.pop()
+        depth = len(self.layers)
+        for name in layer:
+            self._reindex_name(name, depth)
+        return label, layer
+
+    @property
+    def depth(self):
+        return len(self.layers)
+
+    def top_layer(self, name):
+        """
+        Returns the index of the top layer defining a name, or None if it is only defined in the base
+        """
+        return self._index.get(name)
+
+    def snapshot(self):
+        """
+        Returns a token which can be passed to rollback or view, the current depth
+        """
+        return self.depth
+
+    def rollback(self, depth):
+        """
+        Pops layers until only depth layers remain
+        """
+        while self.depth > depth:
+            self.pop_layer()
+
+    def view(self, depth=None):
+        """
+        Returns a read only LayeredConfig sharing the base and the bottom depth layers
+        """
+        depth = self.depth if depth is None else depth
+        view = LayeredConfig(self.base, self.labels[0], read_only=True)
+        for label, layer in zip(self.labels[1:depth + 1], self.layers[:depth]):
+            view.layers.append(layer)
+            view.labels.append(label)
+            for name in layer:
+                view._index_name(name, len(view.layers) - 1)
+        return view
+
+    def flatten(self):
+        """
+        Returns the current state as a plain dict
+        """
+        return dict(self._flattened())
+
+    def _flattened(self):
+        if self._flat is None:
+            self._flat = self.base.flatten() if isinstance(self.base, LayeredConfig) else dict(self.base)
+            for layer in self.layers:
+                self._flat.update(layer)
+        return self._flat
+
+    def __getitem__(self, name):
+        if (layer_index := self._index.get(name)) is not None:
+            return self.layers[layer_index][name]
+        return self.base[name]
+
+    def __setitem__(self, name, value):
+        self._check_writable()
+        if not self.layers:
+            self.push_layer(None)
+        self.layers[-1][name] = value
+        self._index_name(name, len(self.layers) - 1)
+        if self._flat is not None:
+            self._flat[name] = value
+
+    def __delitem__(self, name):
+        """
+        Removes a name from the top layer, exposing the value below it
+        Names defined in lower layers or the base cannot be deleted
+        """
+        self._check_writable()
+        if not self.layers or name not in self.layers[-1]:
+            raise KeyError(f"Only names in the top layer can be deleted: {name}")
+        del self.layers[-1][name]
+        self._reindex_name(name, len(self.layers) - 1)
+
+    def __contains__(self, name):
+        return name in self._index or name in self.base
+
+    def __iter__(self):
+        return iter(self._flattened())
+
+    def __len__(self):
+        return len(self.base) + self._added
+
+    def keys(self):
+        return self._flattened().keys()
+
+    def items(self):
+        return self._flattened().items()
+
+    def values(self):
+        return self._flattened().values()
 
 
 class KernelConfig:
     """
     A collection of kernel config parameters
+    Config files are loaded through KernelConfig.cache when it is set
     """
-    def __init__(self, config_file=None, config_parameters=[]):
+    cache = None
+
+    def __init__(self, config_file=None, config_parameters=[], keep_raw=False):
         if not config_file and not config_parameters:
             raise ValueError("Either a config file or parameters should be defined")
 
+        self.keep_raw = keep_raw
+
         self.config_file = config_file
         logger.debug("Set the config file to: %s", self.config_file)
 
@@ -172,81 +461,414 @@ class KernelConfig:
         if self.config_parameters:
             self.process_list_parameters()
 
+    @classmethod
+    def from_lines(cls, lines, name=None, keep_raw=False):
+        """
+        Creates a KernelConfig from an iterable of raw config lines
+        The name is only used for logging and error messages
+        """
+        kernel_config = cls.from_mapping({}, keep_raw=keep_raw)
+        kernel_config.config = kernel_config._parse_lines(lines, name or '<lines>')
+        return kernel_config
+
+    @classmethod
+    def from_mapping(cls, config, config_file=None, keep_raw=False):
+        """
+        Creates a KernelConfig around an existing mapping of names to KernelConfigParameters
+        """
+        kernel_config = cls.__new__(cls)
+        kernel_config.keep_raw = keep_raw
+        kernel_config.config_file = config_file
+        kernel_config.config_parameters = []
+        kernel_config.config = config
+        return kernel_config
+
+    @staticmethod
+    def iter_parameters(lines, keep_raw=False):
+        """
+        Lazily tokenizes an iterable of config lines, yielding KernelConfigParameters
+        Lines which are not config parameters are skipped
+        """
+        debug = logger.isEnabledFor(logging.DEBUG)
+        from_line = KernelConfigParameter.from_line
+        for line_number, line in enumerate(lines, 1):
+            if (parameter := from_line(line, keep_raw, line_number)) is not None:
+                yield parameter
+            elif debug:
+                logger.debug(KernelConfigParameter.skip_reason(line))
+
+    @classmethod
+    def iter_file(cls, config_file_name, keep_raw=False):
+        """
+        Streams the parameters of a config file as a generator
+        Regular files are memory mapped and decoded one line at a time,
+        so the whole file is never held in memory as a list of strings
+        Pipes and other files that cannot be mapped are read line by line
+        """
+        with open(config_file_name, 'rb') as config_file:
+            if not S_ISREG(os.fstat(config_file.fileno()).st_mode):
+                logger.debug("Reading config file without mapping, it is not a regular file: %s", config_file_name)
+                yield from cls.iter_parameters((line.decode() for line in config_file), keep_raw)
+                return
+            try:
+                config_map = mmap(config_file.fileno(), 0, access=ACCESS_READ)
+            except ValueError:
+                # Empty files cannot be mapped
+                logger.debug("Unable to map config file, it is empty: %s", config_file_name)
+                return
+            except OSError as e:
+                logger.debug("Unable to map config file '%s', reading it line by line: %s", config_file_name, e)
+                yield from cls.iter_parameters((line.decode() for line in config_file), keep_raw)
+                return
+            with config_map:
+                lines = (line.decode() for line in iter(config_map.readline, b''))
+                yield from cls.iter_parameters(lines, keep_raw)
+
+    def _parse_lines(self, lines, source_name):
+        """
+        Tokenizes and returns an iterable of config lines as a dict
+        """
+        return self._collect(self.iter_parameters(lines, self.keep_raw), source_name)
+
     def _load_config(self, config_file_name):
         """
         Processes and returns a config file as a dict
         """
-        logger.debug("Loading the config file: %s", config_file_name)
-        with open(config_file_name, 'r') as config_file:
-            kernel_config = {}
-            logger.info("Processing the config file: %s", config_file.name)
-            for line in config_file.readlines():
-                try:
-                    config_parameter = KernelConfigParameter(line)
-                    kernel_config[config_parameter.name] = config_parameter
-                # Allow the value errors but throw errors
-                except ParserError as e:
-                    logger.error(e)
-                except ParserWarning as e:
-                    logger.debug(e)
-            # Throw a value error if the file could not be processed
-            if not kernel_config:
-                raise RuntimeWarning(f"Failed to load kernel config from {config_file_name}")
+        # Raw lines are not cached, so bypass the cache when they are requested
+        cache = None if self.keep_raw else self.cache
+        if not cache:
+            logger.info("Processing the config file: %s", config_file_name)
+            return self._collect(self.iter_file(config_file_name, self.keep_raw), config_file_name)
+
+        with open(config_file_name, 'rb') as config_file:
+            file_stat = os.fstat(config_file.fileno())
+            if not S_ISREG(file_stat.st_mode):
+                # Hashing a pipe for the cache key would drain it, so it is parsed directly
+                logger.info("Processing the config file without the cache, it is not a regular file: %s",
+                            config_file_name)
+                lines = (line.decode() for line in config_file)
+                return self._collect(self.iter_parameters(lines, self.keep_raw), config_file_name)
+            # The file is mapped, so it is hashed and parsed on a miss without being copied into memory
+            try:
+                content = mmap(config_file.fileno(), 0, access=ACCESS_READ)
+            except ValueError:
+                # Empty files cannot be mapped
+                content = b''
+            except OSError as e:
+                logger.debug("Unable to map config file '%s', reading it: %s", config_file_name, e)
+                content = config_file.read()
+
+        try:
+            # The bytes hashed for the cache key are the same bytes parsed on a miss
+            entry_path = cache.entry_path(config_file_name, file_stat, content)
+            if (kernel_config := cache.get(entry_path, config_file_name)) is not None:
+                logger.info("Loaded the config file from the cache: %s", config_file_name)
+                return kernel_config
+
+            logger.info("Processing the config file: %s", config_file_name)
+            reader = content if isinstance(content, mmap) else BytesIO(content)
+            lines = (line.decode() for line in iter(reader.readline, b''))
+            kernel_config = self._collect(self.iter_parameters(lines, self.keep_raw), config_file_name)
+        finally:
+            if isinstance(content, mmap):
+                content.close()
+        cache.put(entry_path, config_file_name, kernel_config)
+        return kernel_config
+
+    @staticmethod
+    def _collect(parameters, source_name):
+        """
+        Collects parameters into a dict keyed by name, later definitions replace earlier ones
+        """
+        kernel_config = {parameter.name: parameter for parameter in parameters}
+        # Throw a value error if the file could not be processed
+        if not kernel_config:
+            raise RuntimeWarning(f"Failed to load kernel config from {source_name}")
         return kernel_config
 
     def process_list_parameters(self):
         """
         Iterates through the custom parameters and attempts to apply them over the base config
         """
-        for parameter in self.config_parameters:
+        for index, parameter in enumerate(self.config_parameters, 1):
             logger.debug("Attempting to parse passed config parameter: %s", parameter)
             try:
-                config_parameter = KernelConfigParameter(parameter)
+                config_parameter = KernelConfigParameter(parameter, self.keep_raw, index)
                 self.config[config_parameter.name] = config_parameter
                 logger.debug("Loaded config parameter from list: %s", config_parameter)
             except ParserWarning as e:
                 logger.warning(e)
 
+    def overlay(self):
+        """
+        Returns a copy-on-write KernelConfig layered over this config, see LayeredConfig
+        Changes made to the overlay are stored in its own layers, this config is left unmodified
+        """
+        return self.from_mapping(LayeredConfig(self.config, self.config_file), self.config_file, self.keep_raw)
+
+    def iter_lines(self):
+        """
+        Yields each kernel config parameter as a config line
+        """
+        for parameter in self.config.values():
+            yield f"{parameter}\n"
+
+    def write(self, file_name):
+        """
+        Streams the config into file_name, see write_file
+        Returns True if the file was written, False if it already had the same contents
+        """
+        return write_file(file_name, self.iter_lines())
+
     def __str__(self):
         """
-        Iterates through all kernel config parameters and outputs them as a large string
+        Outputs all kernel config parameters as a large string
         """
-        out_str = ''
-        for name, parameter in self.config.items():
-            out_str += str(parameter) + "\n"
+        return ''.join(self.iter_lines())
 
-        return out_str
+
+class ConfigDiff:
+    """
+    Structured differences between an expected and an actual KernelConfig
+
+    added: options only set in the actual config
+    removed: undefines in the expected config which are missing from the actual config
+    dropped: defines in the expected config which are missing from the actual config,
+             usually because make dropped them
+    changed: options in both configs with different values
+    """
+    def __init__(self, expected_config, actual_config):
+        # Layered configs are flattened once, so each lookup below is a plain dict lookup
+        expected, actual = (config.flatten() if isinstance(config, LayeredConfig) else config
+                            for config in (expected_config.config, actual_config.config))
+
+        missing = expected.keys() - actual.keys()
+        self.added = {name: actual[name] for name in sorted(actual.keys() - expected.keys())}
+        self.dropped = {name: expected[name] for name in sorted(missing)
+                        if expected[name].define_type == ConfigLineTypes.DEFINE}
+        self.removed = {name: expected[name] for name in sorted(missing)
+                        if expected[name].define_type == ConfigLineTypes.UNDEFINE}
+        self.changed = {name: (expected[name], actual[name]) for name in sorted(expected.keys() & actual.keys())
+                        if not expected[name].same_value(actual[name])}
+        # Filled by KConfig.explain, maps option names to DependencyExplainer explanations
+        self.explanations = {}
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.dropped or self.changed)
+
+    @staticmethod
+    def _value(parameter):
+        """ Returns the JSON value of a parameter, undefines are None """
+        return None if parameter.define_type == ConfigLineTypes.UNDEFINE else parameter.value
+
+    def to_dict(self):
+        """
+        Returns the differences as a JSON serializable dict
+        """
+        return {'added': {name: self._value(parameter) for name, parameter in self.added.items()},
+                'removed': list(self.removed),
+                'dropped': {name: self._value(parameter) for name, parameter in self.dropped.items()},
+                'changed': {name: {'expected': self._value(expected), 'actual': self._value(actual)}
+                            for name, (expected, actual) in self.changed.items()},
+                **({'explanations': self.explanations} if self.explanations else {})}
+
+    def to_json(self, indent=2):
+        """
+        Returns the differences as a JSON string
+        """
+        return json.dumps(self.to_dict(), indent=indent)
+
+    def log(self):
+        """
+        Logs the options which did not end up with their expected value
+        """
+        for parameter in self.dropped.values():
+            logger.warning("Argument is undefined when it should be set: %s", parameter)
+        for name, (expected, actual) in self.changed.items():
+            logger.warning("Argument value mismatch for: %s :: Found: %s | Expected: %s",
+                           name, actual.value, expected.value)
+        logger.debug("Options added: %s | removed: %s", len(self.added), len(self.removed))
+        for name, explanation in self.explanations.items():
+            for reason in explanation['reasons']:
+                logger.warning("%s: %s", name, reason)
+            if explanation['required']:
+                logger.warning("%s: Also set: %s", name,
+                               ' '.join(f"CONFIG_{option}={value}" for option, value in explanation['required'].items()))
+            elif explanation['required'] is None:
+                logger.warning("%s: No option values were found which would allow it", name)
 
 
 class KConfig:
     """
-    Parses and represents KConfig information
+    Kconfig information for a kernel tree
+    Wraps a kconfig.SymbolTable, which follows source statements and is cached per tree
     """
-    _KCONFIG_FILE_REGEX = re.compile(r"/(Kconfig)(\.|-)?([a-zA-Z0-9])*$")
     _EXCLUDED_SEARCH_DIRS = ['Documentation']
 
+    def __init__(self, tree='.', jobs=None, cache_dir=DEFAULT_CACHE_DIR):
+        logger.debug("Initializing KConfig for tree: %s", tree)
+        self.symbol_table = SymbolTable.load(tree, jobs=jobs, cache_dir=cache_dir)
+
+    def validate(self, kernel_config):
+        """
+        Checks a KernelConfig for unknown symbols and values of the wrong type
+        Logs and returns a list of (name, message) tuples
+        """
+        issues = self.symbol_table.validate({name: parameter.value for name, parameter in kernel_config.config.items()})
+        for name, message in issues:
+            logger.warning("%s: %s", message, name)
+        return issues
+
+    def resolve(self, kernel_config, allnoconfig=False):
+        """
+        Resolves a merged KernelConfig in process, see kconfig.Resolver
+        Returns a KernelConfig like the one make alldefconfig or allnoconfig would write
+        """
+        resolver = Resolver(self.symbol_table, allnoconfig=allnoconfig)
+        values = resolver.resolve({name: parameter.value for name, parameter in kernel_config.config.items()})
+        return KernelConfig.from_lines((f"# CONFIG_{name} is not set" if value == 'n' else f"CONFIG_{name}={value}"
+                                        for name, value in values.items()), name='<kconfig resolver>')
+
+    def explain(self, kernel_config, config_diff, allnoconfig=False):
+        """
+        Explains the dropped and changed options of a ConfigDiff, where kernel_config is the expected config
+        The merged config is resolved in process, so the reasons are those of the resolver, see kconfig.DependencyExplainer
+        Sets and returns config_diff.explanations
+        """
+        resolver = Resolver(self.symbol_table, allnoconfig=allnoconfig)
+        resolver.resolve({name: parameter.value for name, parameter in kernel_config.config.items()})
+        explainer = DependencyExplainer(resolver)
+        wanted = {name: parameter.value for name, parameter in config_diff.dropped.items()}
+        wanted |= {name: 'n' if expected.define_type == ConfigLineTypes.UNDEFINE else expected.value
+                   for name, (expected, actual) in config_diff.changed.items()}
+        config_diff.explanations = {name: explainer.explain(name, value) for name, value in sorted(wanted.items())}
+        return config_diff.explanations
+
+
+class ProvenanceIndex:
+    """
+    Records where each config option was set during a merge
+
+    Source files are stored once and referenced by integer id
+    Each option maps to the (file id, line number) of every source which set it, in the order they were applied,
+    so the last entry is the source of the final value
+    Records can be grouped in layers matching the layers of a LayeredConfig, and rolled back with them
+    """
     def __init__(self):
-        logger.debug("Initializing KConfig")
-        self._load()
-
-    def _load(self):
-        """
-        Attempts to load the kconfig information from the current directory
-        Gets all directories under the current directory
-        Checks for a "Kconfig*"
-        Ex "Kconfig" "Kconfig.isoched"
-        """
-        kconfig_files = []
-        # Returns all directories under the current path, excluding ones defined in _EXCLUDED_SEARCH_DIRS
-        subdirs = [subdir.path for subdir in os.scandir() if subdir.path.replace('./', '') not in self._EXCLUDED_SEARCH_DIRS and subdir.is_dir()]
-        for subdir in subdirs:
-            logger.debug("Scanning directory for Kconfig files: %s", subdir)
-            found_kconfigs = [subdir + re.search(self._KCONFIG_FILE_REGEX, file.path).group() for file in os.scandir(subdir) if re.search(self._KCONFIG_FILE_REGEX, file.path)]
-            if not found_kconfigs:
-                logger.debug("Did not find any Kconfig files in: %s", subdir)
-            else:
-                logger.info("Discovered KConfigs: %s", found_kconfigs)
-                kconfig_files.append(found_kconfigs)
+        self.files = []
+        self._file_ids = {}
+        self.options = {}
+        # The names recorded in each layer, in the order they were recorded
+        self._layers = []
+
+    def file_id(self, file_name):
+        """
+        Returns the id for a source file name, adding it if needed
+        """
+        if (file_id := self._file_ids.get(file_name)) is None:
+            file_id = self._file_ids[file_name] = len(self.files)
+            self.files.append(file_name)
+        return file_id
+
+    def record(self, name, file_id, line_number):
+        """
+        Records that an option was set by a line of a source file
+        """
+        if chain := self.options.get(name):
+            chain.append((file_id, line_number))
+        else:
+            self.options[name] = [(file_id, line_number)]
+        if self._layers:
+            self._layers[-1].append(name)
+
+    def push_layer(self):
+        """
+        Starts a new layer, later records are removed when it is rolled back
+        Returns the depth of the new layer
+        """
+        self._layers.append([])
+        return len(self._layers)
+
+    def rollback(self, depth):
+        """
+        Removes the entries recorded in the layers above depth, so they can be merged again
+        Entries are removed by layer, so a file merged in several layers keeps the entries of the others
+        """
+        while len(self._layers) > depth:
+            # Layers are applied in order, so their entries are the last of each chain
+            for name in reversed(self._layers.pop()):
+                chain = self.options[name]
+                chain.pop()
+                if not chain:
+                    del self.options[name]
+
+    def add_config(self, file_name, kernel_config):
+        """
+        Records every parameter in a KernelConfig as set by file_name
+        """
+        file_id = self.file_id(file_name)
+        for name, parameter in kernel_config.config.items():
+            self.record(name, file_id, parameter.line_number)
+
+    def lookup(self, name):
+        """
+        Returns the (file name, line number) chain for an option, the last entry set the final value
+        """
+        return [(self.files[file_id], line_number) for file_id, line_number in self.options.get(name, [])]
+
+    def copy(self):
+        provenance = ProvenanceIndex()
+        provenance.files = self.files.copy()
+        provenance._file_ids = self._file_ids.copy()
+        provenance.options = {name: chain.copy() for name, chain in self.options.items()}
+        provenance._layers = [layer.copy() for layer in self._layers]
+        return provenance
+
+    def to_dict(self):
+        return {'files': self.files,
+                'options': {name: [list(entry) for entry in chain] for name, chain in self.options.items()}}
+
+    @classmethod
+    def from_dict(cls, provenance_dict):
+        provenance = cls()
+        for file_name in provenance_dict['files']:
+            provenance.file_id(file_name)
+        provenance.options = {name: [tuple(entry) for entry in chain] for name, chain in provenance_dict['options'].items()}
+        return provenance
+
+    def write(self, file_name):
+        """
+        Writes the index to a file as JSON
+        """
+        return write_file(file_name, [json.dumps(self.to_dict())])
+
+    @classmethod
+    def load(cls, file_name):
+        """
+        Loads an index written by write
+        """
+        with open(file_name, 'r') as provenance_file:
+            return cls.from_dict(json.load(provenance_file))
+
+
+def generate_configs(config_file, jobs=1, **renderer_kwargs):
+    """
+    Renders the templates listed in a generate_config config file, and parses each render in memory
+    renderer_kwargs are passed to generate_config.TemplateRenderer, ex. cache_dir, which defaults to its DEFAULT_CACHE_DIR
+    Returns a list of (label, KernelConfig) tuples in the order of the templates, which can be passed to ConfigMerger
+    """
+    from generate_config import TemplateRenderer
+    from yaml import safe_load
+    with open(config_file, 'r') as generate_config_file:
+        variables = safe_load(generate_config_file)
+    templates = variables.pop('templates')
+
+    renderer = TemplateRenderer(jobs=jobs, **renderer_kwargs)
+    generated_configs = []
+    for template, rendered in zip(templates, renderer.render_all(templates, variables)):
+        label = f"<template {template}>"
+        generated_configs.append((label, KernelConfig.from_lines(rendered.splitlines(keepends=True), name=label)))
+    return generated_configs
 
 
 class ConfigMerger:
@@ -257,12 +879,28 @@ class ConfigMerger:
                  custom_parameters=[],
                  allnoconfig=False,
                  no_make=False,
-                 strict_mode=False):
+                 strict_mode=False,
+                 jobs=1,
+                 force_make=False,
+                 compare_file=None,
+                 diff_file=None,
+                 base_config=None,
+                 provenance=None,
+                 provenance_file=None,
+                 kconfig=None,
+                 kconfig_check=False,
+                 kconfig_resolve=False,
+                 verify_resolver=False,
+                 explain=False,
+                 merge_configs=[]):
 
         self.base_file = base_file
         logger.debug("Set the base file name to: %s", self.base_file)
         self.merge_files = merge_files
         logger.debug("Set the merge files to: %s", self.merge_files)
+        # Parsed configs merged after the merge files, as (label, KernelConfig) tuples, ex. from generate_configs
+        self.merge_configs = merge_configs
+        logger.debug("Set the merge configs to: %s", [label for label, _ in self.merge_configs])
         self.custom_parameters = custom_parameters
         logger.debug("Set the custom parameters to: %s", self.custom_parameters)
         self.out_file_name = out_file_name
@@ -274,51 +912,137 @@ class ConfigMerger:
         logger.debug("Set strict mode to: %s", self.strict_mode)
         self.no_make = no_make
         logger.debug("Set no make to: %s", self.no_make)
+        self.jobs = jobs
+        logger.debug("Set jobs to: %s", self.jobs)
+        self.force_make = force_make
+        logger.debug("Set force make to: %s", self.force_make)
+        self.stamp_file_name = f"{self.out_file_name}.stamp"
+        self.compare_file = compare_file
+        logger.debug("Set the compare file to: %s", self.compare_file)
+        self.diff_file = diff_file
+        logger.debug("Set the diff file to: %s", self.diff_file)
+        # A pre-loaded base config is used instead of loading the base file
+        self.base_config = base_config
+        # Records which file and line set each option, should describe base_config if it is passed
+        self.provenance = provenance if provenance is not None else ProvenanceIndex()
+        self.provenance_file = provenance_file
+        logger.debug("Set the provenance file to: %s", self.provenance_file)
+        # Used to validate the merged config, and to resolve it in process instead of running make
+        self.kconfig = kconfig
+        self.kconfig_check = kconfig_check
+        logger.debug("Set Kconfig check to: %s", self.kconfig_check)
+        self.kconfig_resolve = kconfig_resolve
+        logger.debug("Set Kconfig resolve to: %s", self.kconfig_resolve)
+        self.verify_resolver = verify_resolver
+        logger.debug("Set verify resolver to: %s", self.verify_resolver)
+        self.explain = explain
+        logger.debug("Set explain to: %s", self.explain)
+        if (kconfig_check or kconfig_resolve or verify_resolver or explain) and not kconfig:
+            raise ValueError("A KConfig must be passed to check or resolve using Kconfig")
 
     def process(self):
         """
         Processes the config based on the supplied parameters
         """
-        # Load the base config
-        self.base_config = KernelConfig(config_file=self.base_file)
+        self.merge()
+        self.build()
+
+    def build(self, defer_make=False):
+        """
+        Writes the merged config, runs it through make unless no_make is set, and compares the result
+        If defer_make is set and make must be run, returns True without running it,
+        make_config or make_config_async, then finish_make, should be called by the caller
+        """
+        if self.kconfig_check:
+            self.check_kconfig()
+
+        if not self.no_make and self.kconfig_resolve:
+            logger.info("Resolving the merged config using the Kconfig files")
+            resolved_config = self.kconfig.resolve(self.base_config, self.allnoconfig)
+            resolved_config.write(self.out_file_name)
+            self._compare_config(resolved_config)
+        elif not self.no_make:
+            if not self._reuse_make_output():
+                self.write_config()
+                if defer_make:
+                    return True
+                self.make_config()
+            self.finish_make()
+        else:
+            self.write_config()
+            if self.compare_file:
+                self._compare_config(KernelConfig(self.compare_file))
+
+    def finish_make(self):
+        """
+        Compares the make output with the merged config
+        """
+        make_processed_config = KernelConfig(self.out_file_name)
+        if self.verify_resolver:
+            self._verify_resolver(make_processed_config)
+        self._compare_config(make_processed_config)
+
+    def merge(self):
+        """
+        Loads the base config if it was not passed, then merges the files and parameters over it
+        """
+        if self.base_config is None:
+            self.base_config = KernelConfig(config_file=self.base_file)
+            self.provenance.add_config(self.base_file, self.base_config)
         # Merge config files
-        if self.merge_files or self.custom_parameters:
+        if self.merge_files or self.merge_configs or self.custom_parameters:
             self.process_merge()
         else:
             logger.error("No merge files or custom parameters specified")
 
-        if not self.no_make:
-            # test_kconfig = KConfig()
-            self.write_config()
-            self.make_config()
-            make_processed_config = KernelConfig(self.out_file_name)
-            self._compare_config(make_processed_config)
-        else:
-            self.write_config()
+    def check_kconfig(self):
+        """
+        Validates the merged config against the Kconfig symbol table
+        In strict mode, any unknown symbol or invalid value is a failure
+        """
+        issues = self.kconfig.validate(self.base_config)
+        if issues and self.strict_mode:
+            raise RuntimeError(f"Strict mode is enabled and Kconfig validation found {len(issues)} issues")
+        logger.info("Kconfig validation found %s issues", len(issues))
+        return issues
 
-    def _compare_config(self, other_config):
+    def _verify_resolver(self, make_processed_config):
         """
-        Compare the key differences between then loaded config and old config
-        Both objects should be the dict type used in this script
-        """
-        for name, config in self.base_config.config.items():
-            logger.debug("Checking config name: %s", name)
-            if name not in other_config.config and config.define_type == ConfigLineTypes.DEFINE:
-                logger.warning("Argument is undefined when it should be set: %s",
-                               config)
-            elif name in other_config.config and other_config.config.get(name).value != config.value:
-                logger.warning("Argument value mismatch for: %s :: Found: %s | Expected: %s",
-                               name,
-                               other_config.config[name].value,
-                               config.value)
-            else:
-                logger.debug("Config check passed")
+        Resolves the merged config in process, and compares the result against the make output
+        Returns the ConfigDiff, with the make output as the expected config
+        """
+        resolver_diff = ConfigDiff(make_processed_config, self.kconfig.resolve(self.base_config, self.allnoconfig))
+        for name, (make_value, resolved_value) in resolver_diff.changed.items():
+            logger.warning("Resolver mismatch for: %s :: Make: %s | Resolver: %s", name, make_value.value, resolved_value.value)
+        for name in [*resolver_diff.dropped, *resolver_diff.removed]:
+            logger.warning("Resolver did not output: %s", name)
+        for name in resolver_diff.added:
+            logger.warning("Resolver output an option make did not: %s", name)
+        logger.info("Resolver verification found %s differences",
+                    sum(map(len, (resolver_diff.changed, resolver_diff.dropped, resolver_diff.removed, resolver_diff.added))))
+        return resolver_diff
 
-    def _merge_config(self, merge_config):
+    def _compare_config(self, other_config):
+        """
+        Compares the merged config with another config, logs and returns the ConfigDiff
+        Writes the differences to self.diff_file as JSON if it is set
+        """
+        config_diff = ConfigDiff(self.base_config, other_config)
+        if self.explain and (config_diff.dropped or config_diff.changed):
+            self.kconfig.explain(self.base_config, config_diff, self.allnoconfig)
+        config_diff.log()
+        if self.diff_file:
+            with open(self.diff_file, 'w') as diff_file:
+                diff_file.write(config_diff.to_json())
+            logger.info("Wrote config differences to: %s", self.diff_file)
+        return config_diff
+
+    def _merge_config(self, merge_config, file_id=None):
         """
         Merges the supplied config wile with the base config
         If strict mode is enabled, errors will be emitted when parameters are redefined
         The script should process them all, but will eventually fail
+        If a provenance file id is passed, the parameters which were not rejected are recorded under it
         """
         changed = False
         for name, config in merge_config.config.items():
@@ -326,7 +1050,8 @@ class ConfigMerger:
                 if self.strict_mode:
                     logger.error("Attempting to redefine in strict mode: %s", config)
                     self._strict_fail = True
-                elif config.value == self.base_config.config[name].value:
+                    continue
+                elif config.same_value(self.base_config.config[name]):
                     logger.debug("Merge value equals base value: %s", config)
                 elif config.define_type == ConfigLineTypes.DEFINE:
                     logger.info("Updated value: %s", config)
@@ -351,6 +1076,8 @@ class ConfigMerger:
                     changed = True
                 else:
                     logger.warning("Unexpected config value: %s", config)
+            if file_id is not None:
+                self.provenance.record(name, file_id, config.line_number)
         if not changed:
             raise RuntimeWarning("No changes detected after processing config")
 
@@ -362,55 +1089,614 @@ class ConfigMerger:
         Substitutes the generated config into KCONFIG_ALLCONFIG
         https://docs.kernel.org/kbuild/kconfig.html
         """
-        env = os.environ.copy()
-        env['KCONFIG_ALLCONFIG'] = self.out_file_name
-        env['KCONFIG_CONFIG'] = self.out_file_name
-        make_args = "make allnoconfig" if self.allnoconfig else "make alldefconfig"
-        logger.info("Running the following make command: %s", make_args)
+        stamp = self._input_stamp()
+        make_args = self._make_args()
+        logger.info("Running the following make command: %s", ' '.join(make_args))
         try:
-            subprocess.check_output(make_args.split(), env=env, stderr=subprocess.STDOUT)
+            subprocess.check_output(make_args, env=self._make_env(), stderr=subprocess.STDOUT)
         except subprocess.CalledProcessError as e:
-            raise RuntimeError(f"Unable to run make command, args: {make_args}  |  error: {e}")
+            raise RuntimeError(f"Unable to run make command, args: {' '.join(make_args)}  |  error: {e}")
+        self._write_make_stamp(stamp)
+
+    async def make_config_async(self, output_dir=None):
+        """
+        Runs the output .config file through make like make_config, as an asyncio subprocess
+        If output_dir is passed, make is run with O=output_dir, so several runs can share a kernel tree
+        Output lines are logged at debug level as they are read, returns the make output
+        """
+        # The stamp reads the output file and may walk the Kconfig tree, so it is made off the event loop
+        stamp = await asyncio.to_thread(self._input_stamp)
+        make_args = self._make_args(output_dir)
+        logger.info("Running the following make command: %s", ' '.join(make_args))
+        process = await asyncio.create_subprocess_exec(*make_args, env=self._make_env(),
+                                                       stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+        output = []
+        async for line in process.stdout:
+            output.append(line.decode(errors='replace'))
+            logger.debug("[%s] %s", self.out_file_name, output[-1].rstrip())
+        if await process.wait():
+            raise RuntimeError(f"Unable to run make command, args: {' '.join(make_args)}  |  exit status: {process.returncode}"
+                               f"  |  output: {''.join(output[-10:])}")
+        self._write_make_stamp(stamp)
+        return ''.join(output)
+
+    def _input_stamp(self):
+        with open(self.out_file_name, 'rb') as out_file:
+            return self._make_stamp(sha256(out_file.read()).hexdigest())
+
+    def _make_env(self):
+        """
+        Returns the make environment, the output file is used as both the input and output config
+        Paths are absolute as make resolves them from the output directory when O= is passed
+        """
+        env = os.environ.copy()
+        env['KCONFIG_ALLCONFIG'] = os.path.abspath(self.out_file_name)
+        env['KCONFIG_CONFIG'] = os.path.abspath(self.out_file_name)
+        return env
+
+    def _write_make_stamp(self, stamp):
+        with open(self.out_file_name, 'r') as out_file:
+            stamp['output'] = out_file.read()
+        write_file(self.stamp_file_name, [json.dumps(stamp)])
+        logger.debug("Wrote make stamp file: %s", self.stamp_file_name)
+
+    def _make_args(self, output_dir=None):
+        """
+        Returns the make command as an argument list, output_dir is passed as O= without splitting it
+        """
+        make_args = ['make', 'allnoconfig' if self.allnoconfig else 'alldefconfig']
+        return [*make_args, f"O={output_dir}"] if output_dir else make_args
+
+    def _make_stamp(self, input_hash):
+        """
+        Returns the make stamp for a hash of the merged make input
+        The stamp covers the merged input, the Kconfig state of the kernel tree and the make mode
+        """
+        return {'input': input_hash,
+                'kconfig': self._kconfig_state(),
+                'mode': ' '.join(self._make_args())}
+
+    def _reuse_make_output(self):
+        """
+        Writes the previous make output if the make input is unchanged since the last run
+        The output file is not touched if it already holds that output
+        Returns True if the previous make output was used
+        """
+        if self.force_make:
+            return False
+
+        input_hash = sha256()
+        for line in self.base_config.iter_lines():
+            input_hash.update(line.encode())
+        if (make_output := self._read_make_stamp(self._make_stamp(input_hash.hexdigest()))) is None:
+            return False
+
+        logger.info("Make input is unchanged, reusing the previous make output: %s", self.stamp_file_name)
+        write_file(self.out_file_name, [make_output])
+        return True
+
+    def _read_make_stamp(self, stamp):
+        """
+        Returns the make output stored in the stamp file if it matches the passed stamp, otherwise None
+        """
+        try:
+            with open(self.stamp_file_name, 'r') as stamp_file:
+                previous_stamp = json.load(stamp_file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning("Unable to read make stamp file '%s': %s", self.stamp_file_name, e)
+            return None
+
+        for key, value in stamp.items():
+            if previous_stamp.get(key) != value:
+                logger.debug("Make stamp mismatch for: %s", key)
+                return None
+        return previous_stamp.get('output')
+
+    @staticmethod
+    @cache
+    def _kconfig_state():
+        """
+        Hashes the names, sizes and mtimes of the Kconfig files and top Makefile in the current kernel tree
+        Also includes the environment variables which change how Kconfig is evaluated
+
+        The Kconfig files are found by following source statements from the top level Kconfig,
+        so files added under a globbed source directory change the state through their names,
+        and the rest of the tree, including build output, is not walked
+        The files are found once per process, ConfigWatcher clears the cached state before each rebuild
+        """
+        state_hash = sha256()
+        for name in ('ARCH', 'SRCARCH', 'CROSS_COMPILE', 'CC', 'LLVM'):
+            state_hash.update(f"{name}={os.environ.get(name, '')}\0".encode())
+
+        kconfig_files = ['Makefile'] if os.path.isfile('Makefile') else []
+        kconfig_files += SymbolTable('.').source_files()
+
+        for kconfig_file in kconfig_files:
+            file_stat = os.stat(kconfig_file)
+            state_hash.update(f"{kconfig_file}\0{file_stat.st_size}\0{file_stat.st_mtime_ns}\0".encode())
+        return state_hash.hexdigest()
 
     def process_merge(self):
         """
         Iterates through the merge files and attempts to apply them over the base config
         """
-        # Sections are applied over the base config as they are processed
+        # Sections are applied over the base config as they are processed, each in its own layer
+        if not isinstance(self.base_config.config, LayeredConfig):
+            self.base_config = self.base_config.overlay()
         logger.info("Attempting to merge passed files")
-        for merge_file in self.merge_files:
-            logger.info("Attempting to merge file: %s", merge_file)
-            merge_config = KernelConfig(merge_file)
-            try:
-                self._merge_config(merge_config)
-            except RuntimeWarning as e:
-                logger.warning("%s file: %s", e, merge_file)
+        for merge_file, merge_config in zip(self.merge_files, self._load_merge_configs()):
+            self.merge_layer(merge_file, merge_config)
+
+        for label, merge_config in self.merge_configs:
+            self.merge_layer(label, merge_config)
 
         if self.custom_parameters:
             logger.info("Attempting to merge passed parameters")
-            merge_config = KernelConfig(config_parameters=self.custom_parameters)
-            try:
-                self._merge_config(merge_config)
-            except RuntimeWarning as e:
-                logger.warning("%s parameter: %s", e, self.custom_parameters)
+            self.merge_layer('<parameters>', KernelConfig(config_parameters=self.custom_parameters))
 
+        self._finish_merge()
+
+    def merge_layer(self, label, merge_config):
+        """
+        Merges a parsed config in a new layer of the merged config, recording its provenance under label
+        """
+        logger.info("Attempting to merge: %s", label)
+        self.base_config.config.push_layer(label)
+        self.provenance.push_layer()
+        try:
+            self._merge_config(merge_config, self.provenance.file_id(label))
+        except RuntimeWarning as e:
+            if merge_config.config_parameters:
+                logger.warning("%s parameter: %s", e, merge_config.config_parameters)
+            else:
+                logger.warning("%s file: %s", e, label)
+
+    def _finish_merge(self):
+        """
+        Writes the provenance index if requested, fails if strict mode detected a redefinition
+        """
         logger.info("Merging has completed")
+        if self.provenance_file:
+            self.provenance.write(self.provenance_file)
+            logger.info("Wrote the provenance index to: %s", self.provenance_file)
 
         if self._strict_fail:
             raise RuntimeError("Strict mode is enabled and has detected a failure")
 
+    def minimize(self, out_dir):
+        """
+        Writes a minimized copy of each merge file to out_dir, like make savedefconfig, see minimal_layers
+        Lines of parameters which are not needed are removed, other lines are kept
+        Also writes merged.config, a single fragment which reproduces the merged config over the base config
+        Returns a dict of merge file name to the number of parameters removed from it
+        """
+        os.makedirs(out_dir, exist_ok=True)
+        minimal_layers = self.minimal_layers()
+        removed_counts = {}
+        out_names = set()
+        for merge_file, kept in minimal_layers.items():
+            if merge_file not in self.merge_files:
+                continue
+            out_name = os.path.join(out_dir, os.path.basename(merge_file))
+            if out_name in out_names:
+                out_name = os.path.join(out_dir, f"{len(out_names)}-{os.path.basename(merge_file)}")
+            out_names.add(out_name)
+            kept_lines = {parameter.line_number for parameter in kept.values()}
+            with open(merge_file, 'r') as config_file:
+                lines = config_file.readlines()
+            minimized_lines = [line for line_number, line in enumerate(lines, 1)
+                               if line_number in kept_lines or KernelConfigParameter.from_line(line) is None]
+            removed_counts[merge_file] = len(lines) - len(minimized_lines)
+            write_file(out_name, minimized_lines)
+            logger.info("Removed %s of the parameters of %s, wrote: %s", removed_counts[merge_file], merge_file, out_name)
+
+        merged_out_name = os.path.join(out_dir, 'merged.config')
+        write_file(merged_out_name, (f"{parameter}\n" for kept in minimal_layers.values() for parameter in kept.values()))
+        logger.info("Wrote the minimal fragment for the merged config: %s", merged_out_name)
+        return removed_counts
+
+    def minimal_layers(self):
+        """
+        Returns a dict of merge layer label to the parameters of that layer which are needed to reproduce the merged config
+
+        Parameters setting the value already in effect are not merged into a layer, and parameters set again by a later layer are not needed
+        With a KConfig, parameters for options which are not in the base config, and equal the value make would pick
+        without them, as make savedefconfig would omit them, are also removed
+        The result is resolved again, and any parameter needed to get the same resolved values is added back
+        """
+        layered = self.base_config.config
+        minimal_layers = {}
+        for layer_index, (label, layer) in enumerate(zip(layered.labels[1:], layered.layers)):
+            kept = minimal_layers.setdefault(label, {})
+            kept.update({name: parameter for name, parameter in layer.items() if layered.top_layer(name) == layer_index})
+        if not self.kconfig:
+            return minimal_layers
+
+        merged_values = {name: parameter.value for name, parameter in self.base_config.config.items()}
+        resolver = Resolver(self.kconfig.symbol_table, allnoconfig=self.allnoconfig)
+        minimal_values = resolver.minimal_values(merged_values)
+        expected_values = dict(resolver.values)
+        removed = {}
+        for label, kept in minimal_layers.items():
+            for name in list(kept):
+                symbol_name = name.removeprefix('CONFIG_')
+                if symbol_name in self.kconfig.symbol_table.symbols and symbol_name not in minimal_values and name not in layered.base:
+                    removed[name] = (label, kept.pop(name))
+
+        # Resolve the minimized config, add back the parameters of any option which resolves differently
+        while removed:
+            minimized_values = {name: parameter.value for name, parameter in layered.base.items()}
+            minimized_values |= {name: parameter.value for kept in minimal_layers.values() for name, parameter in kept.items()}
+            resolver.resolve(minimized_values)
+            mismatched = [f"CONFIG_{name}" for name, value in expected_values.items() if resolver.values[name] != value]
+            if not (restored := [name for name in mismatched if name in removed]):
+                if mismatched:
+                    logger.warning("Minimized config resolves differently for: %s", ', '.join(mismatched))
+                break
+            for name in restored:
+                label, parameter = removed.pop(name)
+                minimal_layers[label][name] = parameter
+                logger.debug("Restored parameter needed to reproduce the merged config: %s", parameter)
+        return minimal_layers
+
+    def intermediate_config(self, depth):
+        """
+        Returns the merged config as it was after the first depth merge layers were applied
+        Depth 0 is the base config, the result shares its data with the merged config and is read only
+        """
+        return KernelConfig.from_mapping(self.base_config.config.view(depth), self.base_file)
+
+    def _load_merge_configs(self):
+        """
+        Yields the parsed merge files in the order they were passed
+        When jobs is greater than 1, the files are parsed concurrently in a process pool
+        Merging is always done in order by the caller, so the result matches a sequential run
+        """
+        if self.jobs <= 1 or len(self.merge_files) <= 1:
+            for merge_file in self.merge_files:
+                yield KernelConfig(merge_file)
+            return
+
+        logger.info("Parsing %s merge files using %s jobs", len(self.merge_files), self.jobs)
+        with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+            yield from executor.map(KernelConfig, self.merge_files)
+
     def write_config(self):
         """
         writes the base config to the output file
         """
         logger.info("Writing config file: %s", self.out_file_name)
-        if os.path.exists(self.out_file_name):
-            logger.warning("Kernel .config file already exist, overwriting: %s", self.out_file_name)
-        with open(self.out_file_name, 'w') as out_file:
-            out_file.write(str(self.base_config))
+        exists = os.path.exists(self.out_file_name)
+        if not self.base_config.write(self.out_file_name):
+            logger.info("Kernel .config file is unchanged, not overwriting: %s", self.out_file_name)
+            return
+        if exists:
+            logger.warning("Kernel .config file already exist, overwrote: %s", self.out_file_name)
         logger.info("Wrote config file: %s", self.out_file_name)
 
 
+class MakeOrchestrator:
+    """
+    Runs make for several ConfigMergers concurrently, at most jobs at a time
+
+    Each run gets its own scratch O= output directory, so runs sharing a kernel tree do not write to the same files
+    The kernel tree itself must be clean, as make refuses to use O= with a configured source tree
+    Results are collected as the runs finish
+    """
+    def __init__(self, jobs=os.cpu_count(), scratch_dir=None):
+        self.jobs = max(jobs or 1, 1)
+        logger.debug("Set the make jobs to: %s", self.jobs)
+        # The scratch directories are created under this directory, the default is the system temp directory
+        self.scratch_dir = scratch_dir
+        logger.debug("Set the make scratch directory to: %s", self.scratch_dir)
+
+    def run(self, mergers):
+        """
+        Runs make for each merger, returns a dict of merger to the exception its run raised, or None
+        """
+        # Walk the Kconfig tree once up front, instead of in a thread for each run
+        ConfigMerger._kconfig_state()
+        return asyncio.run(self._run_all(mergers))
+
+    async def _run_all(self, mergers):
+        semaphore = asyncio.Semaphore(self.jobs)
+        logger.info("Running make for %s configs using %s jobs", len(mergers), self.jobs)
+        results = {}
+        for finished in asyncio.as_completed([self._run(merger, semaphore) for merger in mergers]):
+            merger, error = await finished
+            if error:
+                logger.error("Make failed for %s: %s", merger.out_file_name, error)
+            else:
+                logger.info("Make finished for: %s", merger.out_file_name)
+            results[merger] = error
+        return results
+
+    async def _run(self, merger, semaphore):
+        async with semaphore:
+            with TemporaryDirectory(prefix='merge_config_make.', dir=self.scratch_dir) as output_dir:
+                try:
+                    await merger.make_config_async(output_dir)
+                except (RuntimeError, OSError) as e:
+                    return merger, e
+        return merger, None
+
+
+class ManifestMerger:
+    """
+    Merges configs for several targets defined in a yaml manifest
+
+    The base config and common fragments are parsed and merged once,
+    each target is then merged over a copy-on-write overlay of that shared config
+
+    Manifest format:
+        base: arch/x86/configs/x86_64_defconfig  # optional
+        common: [list of fragments merged for every target]  # optional
+        parameters: [list of custom parameters merged for every target]  # optional
+        targets:
+          target_name:
+            fragments: [list of fragments]
+            parameters: [list of custom parameters]  # optional
+            output: target_name.config  # optional
+            provenance: target_name.json  # optional, writes the provenance index of the target, like --provenance
+    """
+    def __init__(self, manifest_file, make_jobs=1, **merger_kwargs):
+        self.manifest_file = manifest_file
+        logger.debug("Set the manifest file to: %s", self.manifest_file)
+        # When greater than 1, make is run for that many targets at once by a MakeOrchestrator
+        self.make_jobs = make_jobs
+        logger.debug("Set the make jobs to: %s", self.make_jobs)
+        # Passed to the ConfigMerger for each target, ex. no_make or strict_mode
+        self.merger_kwargs = merger_kwargs
+        logger.debug("Set the merger kwargs to: %s", self.merger_kwargs)
+        self.load_manifest()
+
+    def load_manifest(self):
+        """
+        Loads and checks the manifest file
+        """
+        from yaml import safe_load
+        with open(self.manifest_file, 'r') as manifest_file:
+            manifest = safe_load(manifest_file)
+
+        if not isinstance(manifest, dict) or not isinstance(manifest.get('targets'), dict) or not manifest['targets']:
+            raise ValueError(f"The manifest does not define any targets: {self.manifest_file}")
+
+        self.base_file = manifest.get('base', DEFAULT_CONFIG_FILE)
+        logger.debug("Set the manifest base file to: %s", self.base_file)
+        self.common_files = manifest.get('common') or []
+        logger.debug("Set the common merge files to: %s", self.common_files)
+        self.common_parameters = manifest.get('parameters') or []
+        logger.debug("Set the common parameters to: %s", self.common_parameters)
+        self.targets = {name: target or {} for name, target in manifest['targets'].items()}
+        logger.debug("Set the targets to: %s", list(self.targets))
+
+    def process(self):
+        """
+        Merges the shared config, then processes every target over an overlay of it
+        If make_jobs is greater than 1, the make runs of the targets are deferred and run concurrently
+        """
+        shared_merger = ConfigMerger(self.base_file,
+                                     self.common_files,
+                                     out_file_name=None,
+                                     custom_parameters=self.common_parameters,
+                                     strict_mode=self.merger_kwargs.get('strict_mode', False),
+                                     jobs=self.merger_kwargs.get('jobs', 1))
+        if self.common_files or self.common_parameters:
+            logger.info("Merging the common config for all targets")
+            shared_merger.merge()
+            shared_config = shared_merger.base_config
+        else:
+            shared_config = KernelConfig(config_file=self.base_file)
+            shared_merger.provenance.add_config(self.base_file, shared_config)
+
+        pending_mergers = []
+        for name, target in self.targets.items():
+            logger.info("Processing target: %s", name)
+            target_merger = ConfigMerger(self.base_file,
+                                         target.get('fragments') or [],
+                                         out_file_name=target.get('output', f"{name}.config"),
+                                         custom_parameters=target.get('parameters') or [],
+                                         base_config=shared_config.overlay(),
+                                         provenance=shared_merger.provenance.copy(),
+                                         provenance_file=target.get('provenance'),
+                                         **self.merger_kwargs)
+            target_merger.merge()
+            if target_merger.build(defer_make=self.make_jobs > 1):
+                pending_mergers.append(target_merger)
+
+        if not pending_mergers:
+            return
+        failures = 0
+        for target_merger, error in MakeOrchestrator(self.make_jobs).run(pending_mergers).items():
+            if error:
+                failures += 1
+            else:
+                target_merger.finish_make()
+        if failures:
+            raise RuntimeError(f"Make failed for {failures} of {len(pending_mergers)} targets")
+
+
+class PollingFileWatcher:
+    """
+    Detects file changes by comparing the size, mtime and inode of each file every interval seconds
+    """
+    def __init__(self, file_names, interval=DEFAULT_WATCH_INTERVAL):
+        self.file_names = list(dict.fromkeys(file_names))
+        self.interval = interval
+        self._signatures = {file_name: self._signature(file_name) for file_name in self.file_names}
+
+    @staticmethod
+    def _signature(file_name):
+        try:
+            file_stat = os.stat(file_name)
+        except FileNotFoundError:
+            return None
+        return file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino
+
+    def wait(self):
+        """
+        Blocks until at least one file changes, returns the set of changed file names
+        """
+        while True:
+            sleep(self.interval)
+            changed = set()
+            for file_name in self.file_names:
+                if (signature := self._signature(file_name)) != self._signatures[file_name]:
+                    self._signatures[file_name] = signature
+                    changed.add(file_name)
+            if changed:
+                return changed
+
+    def close(self):
+        pass
+
+
+class InotifyFileWatcher:
+    """
+    Detects file changes using inotify, through the optional inotify_simple module
+
+    The directories holding the files are watched, so files replaced by a rename, as many editors do, are still seen
+    Events arriving within interval seconds of each other are returned together
+    """
+    def __init__(self, file_names, interval=DEFAULT_WATCH_INTERVAL):
+        from inotify_simple import INotify, flags
+        self.interval = interval
+        self.inotify = INotify()
+        watch_flags = flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE
+        # Maps each watch descriptor to the files watched in its directory, by base name
+        self._watched = {}
+        for file_name in dict.fromkeys(file_names):
+            directory, base_name = os.path.split(os.path.abspath(file_name))
+            watch_descriptor = self.inotify.add_watch(directory, watch_flags)
+            self._watched.setdefault(watch_descriptor, {}).setdefault(base_name, []).append(file_name)
+
+    def wait(self):
+        """
+        Blocks until at least one file changes, returns the set of changed file names
+        """
+        changed = set()
+        while not changed:
+            changed.update(self._changed_files(self.inotify.read()))
+        # Collect the rest of a burst of events, such as an editor saving several files
+        while events := self.inotify.read(timeout=self.interval * 1000):
+            changed.update(self._changed_files(events))
+        return changed
+
+    def _changed_files(self, events):
+        for event in events:
+            yield from self._watched.get(event.wd, {}).get(event.name, [])
+
+    def close(self):
+        self.inotify.close()
+
+
+class ConfigWatcher:
+    """
+    Keeps a ConfigMerger up to date with its base and merge files, rebuilding its output on every change
+
+    The parsed files are kept in memory, and each merge file is applied in its own layer,
+    so a changed merge file is parsed again, and only the layers from it onwards are merged again
+    A changed base file is loaded again and every layer is merged over it
+    Changes are detected with inotify when inotify_simple is installed, otherwise the files are polled
+    """
+    def __init__(self, config_merger, interval=DEFAULT_WATCH_INTERVAL):
+        self.config_merger = config_merger
+        self.interval = interval
+        logger.debug("Set the watch interval to: %s", self.interval)
+        # The parsed merge files, then the custom parameters, in the order their layers are applied
+        self.layers = []
+        # Whether strict mode failed while merging each layer
+        self._strict_failures = []
+
+    def _file_watcher(self):
+        file_names = [self.config_merger.base_file, *self.config_merger.merge_files]
+        try:
+            file_watcher = InotifyFileWatcher(file_names, self.interval)
+        except ImportError:
+            logger.info("inotify_simple is not installed, polling for changes every %s seconds", self.interval)
+            return PollingFileWatcher(file_names, self.interval)
+        logger.info("Watching for changes using inotify")
+        return file_watcher
+
+    def load(self):
+        """
+        Loads the base config and parses every merge file
+        """
+        merger = self.config_merger
+        merger.base_config = KernelConfig(config_file=merger.base_file).overlay()
+        merger.provenance = ProvenanceIndex()
+        merger.provenance.add_config(merger.base_file, merger.base_config)
+        self.layers = [(merge_file, merge_config)
+                       for merge_file, merge_config in zip(merger.merge_files, merger._load_merge_configs())]
+        self.layers += merger.merge_configs
+        if merger.custom_parameters:
+            self.layers.append(('<parameters>', KernelConfig(config_parameters=merger.custom_parameters)))
+        self._strict_failures = []
+
+    def remerge(self, index=0):
+        """
+        Merges the layers from index onwards again, then builds the merged config
+        """
+        merger = self.config_merger
+        merger.base_config.config.rollback(index)
+        merger.provenance.rollback(index)
+        del self._strict_failures[index:]
+        for label, merge_config in self.layers[index:]:
+            merger._strict_fail = False
+            merger.merge_layer(label, merge_config)
+            self._strict_failures.append(merger._strict_fail)
+        merger._strict_fail = any(self._strict_failures)
+        # The Kconfig files may have changed since the last build
+        ConfigMerger._kconfig_state.cache_clear()
+        try:
+            merger._finish_merge()
+            merger.build()
+        except RuntimeError as e:
+            logger.error(e)
+
+    def update(self, changed_files):
+        """
+        Parses the changed files, then merges again from the first changed layer
+        """
+        merger = self.config_merger
+        if merger.base_file in changed_files:
+            logger.info("Base file changed, merging every file again: %s", merger.base_file)
+            self.load()
+            return self.remerge()
+
+        if not (indexes := [index for index, (label, _) in enumerate(self.layers) if label in changed_files]):
+            return
+        for index in indexes:
+            self.layers[index] = (self.layers[index][0], KernelConfig(self.layers[index][0]))
+        logger.info("Merging again from: %s", self.layers[indexes[0]][0])
+        self.remerge(indexes[0])
+
+    def watch(self):
+        """
+        Merges and builds the config, then does so again each time a file changes, until interrupted
+        """
+        self.load()
+        self.remerge()
+        file_watcher = self._file_watcher()
+        try:
+            while True:
+                changed_files = file_watcher.wait()
+                logger.warning("Detected changes in: %s", ', '.join(sorted(changed_files)))
+                start = perf_counter()
+                try:
+                    self.update(changed_files)
+                except (RuntimeWarning, OSError) as e:
+                    logger.error("Unable to merge the changes: %s", e)
+                    continue
+                logger.warning("Rebuilt %s in %.1f ms", self.config_merger.out_file_name, (perf_counter() - start) * 1000)
+        except KeyboardInterrupt:
+            logger.info("Stopped watching for changes")
+        finally:
+            file_watcher.close()
+
+
 if __name__ == '__main__':
     debug = int(os.environ.get('DEBUG', 0))
     log_level = logging.DEBUG if debug else logging.INFO
@@ -451,10 +1737,74 @@ if __name__ == '__main__':
     parser.add_argument('-p',
                         action='append',
                         help="Specify parameters by command line")
+    # Add the diff args
+    parser.add_argument('--compare',
+                        type=str,
+                        help="Compare the merged config against this config file instead of the make output")
+    parser.add_argument('--diff-json',
+                        type=str,
+                        help="Write the differences between the merged and compared config to this file as JSON")
+    # Add the force make arg
+    parser.add_argument('--force-make',
+                        action='store_true',
+                        help="Always run make, even if the make input is unchanged since the last run")
+    # Add the jobs arg
+    parser.add_argument('-j',
+                        type=int,
+                        default=1,
+                        help="The number of processes used to parse merge files, the default is 1")
+    # Add the cache args
+    parser.add_argument('--no-cache',
+                        action='store_true',
+                        help="Disable the parsed config, Kconfig and template caches")
+    parser.add_argument('--cache-dir',
+                        type=str,
+                        help=f"The cache directory, the default is {DEFAULT_CACHE_DIR}, templates use the generate_config cache by default")
+    # Add the provenance args
+    parser.add_argument('--provenance',
+                        type=str,
+                        help="Write an index of which file and line set each option to this file as JSON")
+    parser.add_argument('--why',
+                        type=str,
+                        action='append',
+                        help="After merging, print the files and lines which set this option")
+    # Add the Kconfig validation arg
+    parser.add_argument('-k',
+                        action='store_true',
+                        help="Validate the merged config against the Kconfig files of the kernel tree in the current directory")
+    # Add the Kconfig resolver args
+    parser.add_argument('-r',
+                        action='store_true',
+                        help="Resolve the merged config in process using the Kconfig files, instead of running make")
+    parser.add_argument('--verify-resolver',
+                        action='store_true',
+                        help="Run make, then compare its output against the in process Kconfig resolver")
+    parser.add_argument('--explain',
+                        action='store_true',
+                        help="Explain the unmet dependencies and selects of options which did not get their merged value")
+    parser.add_argument('--watch',
+                        action='store_true',
+                        help="Keep running, and merge and build again each time the base or a merge file changes")
+    parser.add_argument('--make-jobs',
+                        type=int,
+                        default=1,
+                        help="Number of make runs done at once in manifest mode, each in its own O= directory")
+    parser.add_argument('--generate',
+                        type=str,
+                        help="Render the templates listed in this generate_config file, and merge them after the merge files")
+    parser.add_argument('--minimize',
+                        type=str,
+                        help="Write minimized copies of the merge files, and a single minimal merged.config, to this directory. "
+                             "Uses the Kconfig defaults if the current directory has a Kconfig file")
+    # Add the manifest arg
+    parser.add_argument('--manifest',
+                        type=str,
+                        help="Merge every target defined in this yaml manifest, instead of the passed files")
     # First take the base argument
     # If this is the only argument, use it as the merge file using the DEFAULT_CONFIG_FILE as the base file
     parser.add_argument('base_file',
                         type=str,
+                        nargs='?',
                         help=f"The base kernel file, defaults to {DEFAULT_CONFIG_FILE}")
     # Then take the rest of the arguments as files to open
     parser.add_argument('merge_files',
@@ -463,6 +1813,27 @@ if __name__ == '__main__':
                         help="Files to be merged")
     args = parser.parse_args()
 
+    if not args.base_file and not args.manifest and not args.generate:
+        parser.error("A base file, manifest or generate config must be passed")
+    if args.watch and args.manifest:
+        parser.error("Watch mode does not support manifests")
+    if args.watch and args.generate:
+        parser.error("Watch mode does not support generated configs, templates are not watched")
+    if args.manifest:
+        # Each manifest target sets its own files, parameters and output
+        manifest_conflicts = [flag for flag, value in (('-o', args.o != DEFAULT_OUT_FILE),
+                                                       ('-d', args.d),
+                                                       ('-p', args.p),
+                                                       ('--compare', args.compare),
+                                                       ('--diff-json', args.diff_json),
+                                                       ('--provenance', args.provenance),
+                                                       ('--why', args.why),
+                                                       ('--generate', args.generate),
+                                                       ('--minimize', args.minimize),
+                                                       ('config files', args.base_file or args.merge_files)) if value]
+        if manifest_conflicts:
+            parser.error(f"Manifest mode does not support: {', '.join(manifest_conflicts)}")
+
     if debug or args.v == 2:
         log_level = logging.DEBUG
     elif args.v == 1:
@@ -470,32 +1841,85 @@ if __name__ == '__main__':
     else:
         log_level = logging.WARNING
     logger.setLevel(log_level)
+    kconfig_logger.setLevel(log_level)
     stdout_handler.setLevel(log_level)
     logger.debug("Parsed the arguments")
 
-    merge_files = []
-    # If the default flag is enabled, move the passed base file to the merge files
-    if args.d or args.base_file and not args.merge_files:
-        logger.info("Using %s as the base config file", DEFAULT_CONFIG_FILE)
-        base_file = DEFAULT_CONFIG_FILE
-        merge_files.append(args.base_file)
-        # if -d is passed, and there are still merge files, add them
-        if args.merge_files:
-            merge_files += args.merge_files
+    if not args.no_cache:
+        KernelConfig.cache = ParsedConfigCache(args.cache_dir or DEFAULT_CACHE_DIR)
+
+    if args.k or args.r or args.verify_resolver or args.explain or args.minimize and os.path.isfile('Kconfig'):
+        kconfig = KConfig(jobs=args.j, cache_dir=None if args.no_cache else args.cache_dir or DEFAULT_CACHE_DIR)
+    else:
+        kconfig = None
+    kconfig_kwargs = {'kconfig': kconfig,
+                      'kconfig_check': args.k,
+                      'kconfig_resolve': args.r,
+                      'verify_resolver': args.verify_resolver,
+                      'explain': args.explain}
+
+    if args.manifest:
+        manifest_merger = ManifestMerger(args.manifest,
+                                         make_jobs=args.make_jobs,
+                                         allnoconfig=args.n,
+                                         strict_mode=args.s,
+                                         no_make=args.m,
+                                         jobs=args.j,
+                                         force_make=args.force_make,
+                                         **kconfig_kwargs)
+        manifest_merger.process()
     else:
-        logger.info("Using %s as the base config file", args.base_file)
-        base_file = args.base_file
-        merge_files = args.merge_files
-
-    for file in merge_files:
-        logger.info("Considering file %s for merge", file)
-
-    config_merger = ConfigMerger(base_file,
-                                 merge_files,
-                                 custom_parameters=args.p,
-                                 out_file_name=args.o,
-                                 allnoconfig=args.n,
-                                 strict_mode=args.s,
-                                 no_make=args.m)
-
-    config_merger.process()
+        merge_files = []
+        # If the default flag is enabled, move the passed base file to the merge files
+        if args.d or args.base_file and not args.merge_files:
+            logger.info("Using %s as the base config file", DEFAULT_CONFIG_FILE)
+            base_file = DEFAULT_CONFIG_FILE
+            merge_files.append(args.base_file)
+            # if -d is passed, and there are still merge files, add them
+            if args.merge_files:
+                merge_files += args.merge_files
+        else:
+            base_file = args.base_file or DEFAULT_CONFIG_FILE
+            logger.info("Using %s as the base config file", base_file)
+            merge_files = args.merge_files
+
+        for file in merge_files:
+            logger.info("Considering file %s for merge", file)
+
+        if args.generate:
+            # Templates use the generate_config cache directory unless one was passed
+            renderer_kwargs = {}
+            if args.no_cache or args.cache_dir:
+                renderer_kwargs['cache_dir'] = None if args.no_cache else args.cache_dir
+            generated_configs = generate_configs(args.generate, jobs=args.j, **renderer_kwargs)
+        else:
+            generated_configs = []
+
+        config_merger = ConfigMerger(base_file,
+                                     merge_files,
+                                     custom_parameters=args.p,
+                                     out_file_name=args.o,
+                                     allnoconfig=args.n,
+                                     strict_mode=args.s,
+                                     no_make=args.m,
+                                     jobs=args.j,
+                                     force_make=args.force_make,
+                                     compare_file=args.compare,
+                                     diff_file=args.diff_json,
+                                     provenance_file=args.provenance,
+                                     merge_configs=generated_configs,
+                                     **kconfig_kwargs)
+
+        if args.watch:
+            ConfigWatcher(config_merger).watch()
+        elif args.minimize:
+            config_merger.merge()
+            config_merger.minimize(args.minimize)
+        else:
+            config_merger.process()
+
+        for name in args.why or []:
+            name = name if name.startswith('CONFIG_') else f"CONFIG_{name}"
+            print(f"{name}: {config_merger.base_config.config.get(name, 'not set')}")
+            for file_name, line_number in config_merger.provenance.lookup(name):
+                print(f"  {file_name}:{line_number}")
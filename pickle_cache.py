@@ -0,0 +1,134 @@
+"""
+On-disk cache of pickled objects, used for parsed config files, Kconfig symbol tables and yaml files
+
+"""
+
+__author__ = "desultory"
+__version__ = "0.1.0"
+
+import logging
+import os
+import pickle
+
+logger = logging.getLogger(__name__)
+
+
+def is_private_dir(path):
+    """
+    Checks if a directory is owned by the current user and not accessible by others
+    Pickled caches are only loaded from private directories, as unpickling can run code
+    """
+    try:
+        dir_stat = os.stat(path)
+    except FileNotFoundError:
+        return False
+    return dir_stat.st_uid == os.getuid() and not dir_stat.st_mode & 0o077
+
+
+class PickleCache:
+    """
+    Directory of pickled entries, each stored in a file named by its key
+
+    Entries are only read from and written to a directory owned by the current user with mode 0700,
+    it is created with that mode if it does not exist
+    Entries are written to a temporary file, then renamed into place
+    When max_size is set, the least recently used entries are evicted once they total more than max_size bytes
+    """
+    _CACHE_SUFFIX = '.pickle'
+
+    def __init__(self, cache_dir, max_size=None, logger=logger):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.logger = logger
+        self._private = None
+
+    def is_private(self):
+        """
+        Returns True if the cache directory is owned by the current user and not accessible by others
+        """
+        if self._private is None:
+            if not os.path.exists(self.cache_dir):
+                return False
+            self._private = is_private_dir(self.cache_dir)
+            if not self._private:
+                self.logger.warning("Not using the cache directory, it must be owned by the current user with mode 0700: %s",
+                                    self.cache_dir)
+        return self._private
+
+    def path(self, key):
+        """
+        Returns the entry path for a key, such as a hex digest
+        """
+        return os.path.join(self.cache_dir, key + self._CACHE_SUFFIX)
+
+    def get(self, entry_path, description):
+        """
+        Returns the object cached in an entry, or None if it is not cached
+        Unreadable entries are removed
+        """
+        if not self.is_private():
+            return None
+        try:
+            with open(entry_path, 'rb') as entry_file:
+                cached = pickle.load(entry_file)
+        except FileNotFoundError:
+            self.logger.debug("Cache miss for: %s", description)
+            return None
+        except (OSError, EOFError, AttributeError, pickle.UnpicklingError) as e:
+            self.logger.warning("Discarding unreadable cache entry for '%s': %s", description, e)
+            self._remove(entry_path)
+            return None
+
+        # Touch the entry so eviction removes the least recently used entries first
+        try:
+            os.utime(entry_path)
+        except OSError as e:
+            self.logger.debug("Unable to touch cache entry for '%s': %s", description, e)
+        self.logger.debug("Cache hit for: %s", description)
+        return cached
+
+    def put(self, entry_path, description, value):
+        """
+        Stores an object in an entry, then evicts old entries if needed
+        Returns True if the entry was written
+        """
+        try:
+            os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+        except OSError as e:
+            self.logger.warning("Unable to create the cache directory '%s': %s", self.cache_dir, e)
+            return False
+        if not self.is_private():
+            return False
+        temp_path = f"{entry_path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, 'wb') as entry_file:
+                pickle.dump(value, entry_file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, entry_path)
+        except OSError as e:
+            self.logger.warning("Unable to write cache entry for '%s': %s", description, e)
+            self._remove(temp_path)
+            return False
+        self.logger.debug("Cached: %s", description)
+        if self.max_size is not None:
+            self.evict()
+        return True
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache is under max_size
+        """
+        entries = [entry for entry in os.scandir(self.cache_dir) if entry.name.endswith(self._CACHE_SUFFIX)]
+        entries = sorted(entries, key=lambda entry: entry.stat().st_mtime_ns)
+        cache_size = sum(entry.stat().st_size for entry in entries)
+        while entries and cache_size > self.max_size:
+            entry = entries.pop(0)
+            self.logger.debug("Evicting cache entry: %s", entry.path)
+            cache_size -= entry.stat().st_size
+            self._remove(entry.path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
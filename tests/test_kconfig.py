@@ -0,0 +1,74 @@
+"""
+Tests the Kconfig resolver against a small kernel tree, see kconfig_tree
+
+kconfig_tree/alldefconfig.config is the output of make alldefconfig with KCONFIG_ALLCONFIG=kconfig_tree/defconfig,
+using a compiler which supports -ffoo and not -fbar
+"""
+
+import os
+import re
+
+from kconfig import DependencyExplainer, Resolver, SymbolTable, parse_expression
+
+TREE = os.path.join(os.path.dirname(__file__), 'kconfig_tree')
+
+
+def config_values(config_file):
+    """ Returns the values of a config file keyed by symbol name, undefines are 'n' """
+    values = {}
+    with open(os.path.join(TREE, config_file)) as kernel_config:
+        for line in kernel_config:
+            if match := re.fullmatch(r'# CONFIG_(\w+) is not set', line.strip()):
+                values[match[1]] = 'n'
+            elif match := re.fullmatch(r'CONFIG_(\w+)=(.*)', line.strip()):
+                values[match[1]] = match[2]
+    return values
+
+
+def resolver():
+    return Resolver(SymbolTable(TREE, jobs=1).parse())
+
+
+def test_resolve_alldefconfig():
+    """ Symbols which do not depend on macros resolve like make alldefconfig """
+    kconfig_resolver = resolver()
+    resolved = kconfig_resolver.resolve(config_values('defconfig'))
+    expected = config_values('alldefconfig.config')
+    assert kconfig_resolver.unknown == {'CC_HAS_FOO', 'FOO_OPT'}
+    assert resolved == {name: value for name, value in expected.items() if name not in kconfig_resolver.unknown}
+
+
+def test_resolve_macro_keeps_user_value():
+    """ Symbols depending on macros keep their user value, those without one are unknown """
+    kconfig_resolver = resolver()
+    resolved = kconfig_resolver.resolve({'CC_NO_BAR': 'n', 'FOO_OPT': 'y'})
+    assert resolved['CC_NO_BAR'] == 'n'
+    assert resolved['FOO_OPT'] == 'y'
+    assert kconfig_resolver.unknown == {'CC_HAS_FOO'}
+
+    resolved = kconfig_resolver.resolve({})
+    assert 'CC_NO_BAR' not in resolved
+    assert kconfig_resolver.unknown == {'CC_HAS_FOO', 'CC_NO_BAR', 'FOO_OPT'}
+
+
+def test_requirements_negated_macro():
+    """ A negated macro or string cannot be changed by setting options, so nothing is required """
+    kconfig_resolver = resolver()
+    kconfig_resolver.resolve({})
+    explainer = DependencyExplainer(kconfig_resolver)
+    assert explainer._requirements(parse_expression('!$(success,$(CC) -fbar)'), 2, set()) is None
+    assert explainer._requirements(parse_expression('!"n" && !$(cc-option,-fbar)'), 2, set()) is None
+
+
+def test_explain_negated_macro_dependency():
+    """ Explaining a symbol which depends on a negated macro does not recurse forever """
+    kconfig_resolver = resolver()
+    kconfig_resolver.resolve({'CC_NO_BAR': 'n'})
+    explanation = DependencyExplainer(kconfig_resolver).explain('CC_NO_BAR', 'y')
+    assert explanation['actual'] == 'n'
+    assert explanation['required'] is None
+
+
+def test_source_files():
+    """ Following source statements without parsing finds the same files as parsing the tree """
+    assert sorted(SymbolTable(TREE).source_files()) == sorted(SymbolTable(TREE, jobs=1).parse().files)
@@ -0,0 +1,30 @@
+"""
+Tests the conditions of definition file entries, see ConditionEngine
+"""
+
+import pytest
+
+from kernel_config import KernelDict
+
+
+def test_nested_list_values():
+    """ Config values which cannot be hashed do not break building a KernelDict, and are checked as they are """
+    kernel_dict = KernelDict({'features': ['ipv6'], 'hosts': [{'name': 'a'}, 'b']})
+    assert kernel_dict.check_expression([{'value': 'ipv6', 'in': 'features'}])
+    assert kernel_dict.check_expression({'value': 'b', 'in': 'hosts'})
+    assert not kernel_dict.check_expression({'value': 'a', 'in': 'hosts'})
+
+
+def test_missing_value():
+    """ Conditions referring to a missing config value raise a KeyError """
+    kernel_dict = KernelDict({'features': ['ipv6']})
+    with pytest.raises(KeyError):
+        kernel_dict.check_expression({'value': 'ipv6', 'in': 'missing'})
+
+
+def test_all_tests_failed():
+    """ An entry whose tests all fail is reported by name, and no entry of the mapping is added """
+    kernel_dict = KernelDict({'features': []})
+    with pytest.raises(ValueError, match="All tests failed for entry 'IPV6'"):
+        kernel_dict.update_from_mapping({'NET': 'y', 'IPV6': {'value': 'y', 'if': [{'value': 'ipv6', 'in': 'features'}]}})
+    assert not kernel_dict
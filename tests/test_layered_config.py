@@ -0,0 +1,130 @@
+"""
+Tests the layers of the merged config and its provenance, see LayeredConfig and ProvenanceIndex
+"""
+
+import pytest
+
+from merge_config import LayeredConfig, ProvenanceIndex
+
+
+def layered_config():
+    """ Returns a config with two layers over a base, as if two files were merged """
+    config = LayeredConfig({'CONFIG_A': 'y', 'CONFIG_B': 'y'})
+    config.push_layer('first.config')
+    config['CONFIG_B'] = 'n'
+    config['CONFIG_C'] = 'y'
+    config.push_layer('second.config')
+    config['CONFIG_A'] = 'm'
+    config['CONFIG_C'] = 'n'
+    config['CONFIG_D'] = 'y'
+    return config
+
+
+def test_layer_order():
+    """ The top layer defining a name wins, names are ordered as if every layer was applied to a dict """
+    config = layered_config()
+    assert config.depth == 2
+    assert config.labels == ['base', 'first.config', 'second.config']
+    assert config.flatten() == {'CONFIG_A': 'm', 'CONFIG_B': 'n', 'CONFIG_C': 'n', 'CONFIG_D': 'y'}
+    assert list(config) == ['CONFIG_A', 'CONFIG_B', 'CONFIG_C', 'CONFIG_D']
+    assert len(config) == 4
+    assert config.top_layer('CONFIG_B') == 0
+    assert config.top_layer('CONFIG_A') == 1
+
+
+def test_pop_layer():
+    """ Popping a layer exposes the values below it, including after the config was iterated """
+    config = layered_config()
+    list(config)
+    assert config.pop_layer() == ('second.config', {'CONFIG_A': 'm', 'CONFIG_C': 'n', 'CONFIG_D': 'y'})
+    assert config.flatten() == {'CONFIG_A': 'y', 'CONFIG_B': 'n', 'CONFIG_C': 'y'}
+    assert dict(config.items()) == config.flatten()
+    assert len(config) == 3
+    assert 'CONFIG_D' not in config
+
+    assert config.pop_layer()[0] == 'first.config'
+    assert dict(config.items()) == {'CONFIG_A': 'y', 'CONFIG_B': 'y'}
+    with pytest.raises(IndexError):
+        config.pop_layer()
+
+
+def test_flat_cache_follows_writes():
+    """ Writes and deletes after the config was iterated are seen by the next iteration """
+    config = layered_config()
+    list(config)
+    with pytest.raises(KeyError):
+        del config['CONFIG_B']
+    config['CONFIG_E'] = 'y'
+    config['CONFIG_B'] = 'm'
+    del config['CONFIG_D']
+    assert dict(config.items()) == {'CONFIG_A': 'm', 'CONFIG_B': 'm', 'CONFIG_C': 'n', 'CONFIG_E': 'y'}
+    assert len(config) == 4
+    del config['CONFIG_C']
+    assert config['CONFIG_C'] == 'y'
+
+
+def test_rollback():
+    """ Rolling back to a snapshot restores the config as it was when the snapshot was taken """
+    config = layered_config()
+    expected = config.flatten()
+    depth = config.snapshot()
+    config.push_layer('third.config')
+    config['CONFIG_A'] = 'n'
+    config['CONFIG_F'] = 'y'
+    list(config)
+    config.rollback(depth)
+    assert config.depth == depth
+    assert dict(config.items()) == expected
+    config.rollback(0)
+    assert dict(config.items()) == {'CONFIG_A': 'y', 'CONFIG_B': 'y'}
+
+
+def test_view():
+    """ Views read through the bottom layers, and cannot be written """
+    config = layered_config()
+    view = config.view(1)
+    assert view.flatten() == {'CONFIG_A': 'y', 'CONFIG_B': 'n', 'CONFIG_C': 'y'}
+    assert view['CONFIG_C'] == 'y'
+    assert 'CONFIG_D' not in view
+    assert len(view) == 3
+    with pytest.raises(TypeError):
+        view['CONFIG_A'] = 'n'
+
+    config.push_layer('third.config')
+    config['CONFIG_B'] = 'y'
+    assert view['CONFIG_B'] == 'n'
+    assert config.view()['CONFIG_B'] == 'y'
+
+
+def test_provenance_rollback():
+    """ Rolling back removes the entries recorded in the rolled back layers, and keeps the others """
+    provenance = ProvenanceIndex()
+    base_id = provenance.file_id('base.config')
+    provenance.record('CONFIG_A', base_id, 1)
+    provenance.push_layer()
+    provenance.record('CONFIG_A', provenance.file_id('first.config'), 3)
+    provenance.record('CONFIG_B', provenance.file_id('first.config'), 4)
+    depth = provenance.push_layer()
+    provenance.record('CONFIG_A', provenance.file_id('second.config'), 1)
+    provenance.record('CONFIG_C', provenance.file_id('second.config'), 2)
+    assert provenance.lookup('CONFIG_A') == [('base.config', 1), ('first.config', 3), ('second.config', 1)]
+
+    provenance.rollback(depth - 1)
+    assert provenance.lookup('CONFIG_A') == [('base.config', 1), ('first.config', 3)]
+    assert provenance.lookup('CONFIG_B') == [('first.config', 4)]
+    assert provenance.lookup('CONFIG_C') == []
+    assert 'CONFIG_C' not in provenance.options
+
+
+def test_provenance_rollback_repeated_file():
+    """ A file merged in several layers keeps the entries of the layers which are not rolled back """
+    provenance = ProvenanceIndex()
+    file_id = provenance.file_id('repeated.config')
+    provenance.push_layer()
+    provenance.record('CONFIG_A', file_id, 1)
+    provenance.push_layer()
+    provenance.record('CONFIG_A', file_id, 1)
+    provenance.rollback(1)
+    assert provenance.lookup('CONFIG_A') == [('repeated.config', 1)]
+    provenance.rollback(0)
+    assert provenance.lookup('CONFIG_A') == []
@@ -0,0 +1,42 @@
+"""
+Tests the on-disk pickle cache, see PickleCache
+"""
+
+import os
+
+from pickle_cache import PickleCache
+
+
+def test_round_trip(tmp_path):
+    """ Entries are stored in a private directory created by the cache, and loaded back """
+    cache = PickleCache(tmp_path / 'cache')
+    entry_path = cache.path('key')
+    assert cache.get(entry_path, 'key') is None
+    assert cache.put(entry_path, 'key', {'CONFIG_FOO': 'y'})
+    assert os.stat(tmp_path / 'cache').st_mode & 0o777 == 0o700
+    assert cache.get(entry_path, 'key') == {'CONFIG_FOO': 'y'}
+
+
+def test_shared_directory(tmp_path):
+    """ Entries are not loaded from or written to a directory others can access """
+    os.chmod(tmp_path, 0o700)
+    PickleCache(tmp_path).put(os.path.join(tmp_path, 'key.pickle'), 'key', 'cached')
+    os.chmod(tmp_path, 0o755)
+    cache = PickleCache(tmp_path)
+    assert cache.get(cache.path('key'), 'key') is None
+    assert not cache.put(cache.path('other'), 'other', 'cached')
+    assert not os.path.exists(cache.path('other'))
+
+
+def test_evict_least_recently_used(tmp_path):
+    """ Once the entries are larger than max_size, the least recently used are evicted """
+    cache = PickleCache(tmp_path / 'cache')
+    for index, name in enumerate(('old', 'used', 'new')):
+        cache.put(cache.path(name), name, 'x' * 1000)
+        os.utime(cache.path(name), ns=(index * 10 ** 9, index * 10 ** 9))
+    cache.get(cache.path('used'), 'used')
+
+    cache.max_size = 2500
+    cache.evict()
+    assert not os.path.exists(cache.path('old'))
+    assert os.path.exists(cache.path('used')) and os.path.exists(cache.path('new'))